@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8:noet
+##  Copyright 2023 sysops.tv ;-)
+##  BSD-2-Clause
+##
+## benchmark für checkzfs mit synthetischen pools
+## erzeugt zfs list daten für N datasets x M snapshots x K hosts und legt fake zfs/ssh in ein temp verzeichnis vor den PATH
+## danach werden die einzelnen phasen von checkzfs (abfrage, parser, datenaufbau, ausgaben) gemessen
+##
+##   python3 bench/checkzfs_bench.py --datasets 1000 --snapshots 100 --hosts 3
+##   python3 bench/checkzfs_bench.py --save base.json             ## ergebnis speichern
+##   python3 bench/checkzfs_bench.py --compare base.json          ## mit gespeichertem ergebnis vergleichen, exit 1 bei regression
+##   python3 bench/checkzfs_bench.py --latency 0.2 --modes plain,agent,compress,legacy   ## get_data pro modus mit bytes über ssh
+##   python3 bench/checkzfs_bench.py --startup-budget 50              ## exit 1 wenn der start mit deaktivierter config länger dauert
+
+import sys
+import os
+import gc
+import json
+import time
+import random
+import shutil
+import subprocess
+import tempfile
+import resource
+import tracemalloc
+import importlib.util
+import argparse
+
+FAKE_ZFS = r'''#!/usr/bin/env python3
+## fake zfs: list und get aus $FAKEZFS_DIR/<host>.tsv, host kommt von fake ssh
+import os, sys, time
+_host = os.environ.get("FAKEZFS_HOST","local")
+_path = os.path.join(os.environ["FAKEZFS_DIR"],_host + ".tsv")
+time.sleep(float(os.environ.get("FAKEZFS_LATENCY","0")))
+_file = open(_path)
+_header = _file.readline().rstrip("\n").split("\t")
+_args = sys.argv[1:]
+_cmd = _args.pop(0)
+_types, _props, _roots, _recursive, _depth = ("filesystem,volume" if _cmd == "list" else "all"), None, [], False, None
+_columns = "name,property,value,source"
+while _args:
+    _arg = _args.pop(0)
+    if _arg == "-t":
+        _types = _args.pop(0)
+    elif _arg == "-o" and _cmd == "get":
+        _columns = _args.pop(0)
+    elif _arg == "-o":
+        _props = _args.pop(0)
+    elif _arg == "-d":
+        _depth = int(_args.pop(0))
+        _recursive = True
+    elif _arg.startswith("-"):
+        _recursive = _recursive or "r" in _arg[1:]
+    elif _cmd == "get" and _props is None:
+        _props = _arg
+    else:
+        _roots.append(_arg)
+_types = {"filesystem","volume","snapshot"} if "all" in _types else set(_types.split(","))
+_props = _props.split(",")
+for _prop in _props:
+    if _prop != "name" and _prop not in _header:
+        sys.stderr.write(f"bad property list: invalid property '{_prop}'\n")
+        sys.exit(2)
+_rc = 0
+if _roots:
+    _names = set(_line.split("\t",1)[0] for _line in open(_path))
+    for _root in _roots:
+        if _root not in _names:
+            sys.stderr.write(f"cannot open '{_root}': dataset does not exist\n")
+            _rc = 1
+def _match(name):
+    if not _roots:
+        return True
+    _dataset = name.split("@")[0]
+    for _root in _roots:
+        if _dataset == _root or (_recursive and _dataset.startswith(_root + "/")):
+            _level = (_dataset[len(_root)+1:].count("/") + 1 if _dataset != _root else 0) + ("@" in name)
+            if _depth is None or _level <= _depth:
+                return True
+    return False
+_index = [_header.index(_prop) for _prop in _props]
+_out = sys.stdout
+for _line in _file:
+    _row = _line.rstrip("\n").split("\t")
+    if _row[1] not in _types or not _match(_row[0]):
+        continue
+    if _cmd == "list":
+        _out.write("\t".join(_row[_i] for _i in _index) + "\n")
+    else:
+        for _prop,_i in zip(_props,_index):
+            _values = {"name":_row[0],"property":_prop,"value":_row[_i],"source":"-"}
+            _out.write("\t".join(_values[_column] for _column in _columns.split(",")) + "\n")
+sys.exit(_rc)
+'''
+
+FAKE_SSH = r'''#!/usr/bin/env python3
+## fake ssh: optionen wie ssh, ControlMaster über eine datei, $FAKESSH_LATENCY beim verbindungsaufbau
+import os, sys, time, subprocess
+_args = sys.argv[1:]
+_host, _cmd, _control, _controlpath, _options = None, [], None, None, {}
+while _args:
+    _arg = _args.pop(0)
+    if not _cmd and _arg in ("-o","-i","-p","-S","-O","-l"):
+        _value = _args.pop(0)
+        if _arg == "-o":
+            _key,_,_val = _value.partition("=")
+            _options[_key] = _val
+        elif _arg == "-S":
+            _controlpath = _value
+        elif _arg == "-O":
+            _control = _value
+    elif not _cmd and _arg.startswith("-"):
+        pass
+    elif _host is None:
+        _host = _arg.split("@")[-1]
+    else:
+        _cmd.append(_arg)
+_controlpath = _controlpath or _options.get("ControlPath")
+if _control == "check":
+    sys.exit(0 if _controlpath and os.path.exists(_controlpath) else 255)
+if _control == "exit":
+    if _controlpath and os.path.exists(_controlpath):
+        os.unlink(_controlpath)
+    sys.exit(0)
+if not (_controlpath and os.path.exists(_controlpath)): ## neue verbindung
+    time.sleep(float(os.environ.get("FAKESSH_LATENCY","0")))
+    if _controlpath and _options.get("ControlMaster") == "auto":
+        open(_controlpath,"w").close()
+sys.exit(subprocess.call(" ".join(_cmd),shell=True,env=dict(os.environ,FAKEZFS_HOST=_host)))
+'''
+
+FIELDS = ["name","type","creation","guid","used","available","written","origin","com.sun:auto-snapshot","tv.sysops:checkzfs","snapshots_changed"]
+LABELS = ("zfs-auto-snap_frequent","zfs-auto-snap_hourly","zfs-auto-snap_daily","bashclub-zfs","backup-zfs","manual")
+
+def generate(datadir,datasets,snapshots,hosts,overlap,rollback,seed=1):
+    ## quelle "local" und hosts-1 replika hosts, replikate haben einen teil der snapshots der quelle (die neuesten fehlen evtl.)
+    ## rollback: auf der quelle wurden die neuesten snapshots verworfen, das replikat hat noch die alten
+    _random = random.Random(seed)
+    _now = int(time.time())
+    _hosts = {"local": []}
+    _replicas = [f"replica{_i}" for _i in range(1,hosts)]
+    for _host in _replicas:
+        _hosts[_host] = []
+    def _dataset(host,name,dstype="filesystem",autosnapshot="-",checkzfs="-"):
+        _hosts[host].append([name,dstype,str(_now - 10**7),str(_random.getrandbits(63)),str(_random.randint(10**6,10**11)),str(10**12),"0","-",autosnapshot,checkzfs,str(_now - 60)])
+    def _snapshot(host,dataset,snapshot):
+        _name, _creation, _guid, _written = snapshot
+        _hosts[host].append([f"{dataset}@{_name}","snapshot",str(_creation),_guid,str(_written),"-",str(_written),"-","-","-","-"])
+    _dataset("local","rpool")
+    _dataset("local","rpool/data")
+    for _host in _replicas:
+        _dataset(_host,"tank",autosnapshot="false")
+        _dataset(_host,"tank/replica",autosnapshot="false")
+    for _i in range(datasets):
+        _name = f"rpool/data/vm-{_i}-disk-{_i % 3}"
+        _dstype = "volume" if _i % 4 else "filesystem"
+        _snaps = []
+        for _j in range(snapshots):
+            _label = LABELS[_j % len(LABELS)]
+            _creation = _now - (snapshots - _j) * 900 - _random.randint(0,60)
+            _snaps.append((f"{_label}-{time.strftime('%Y-%m-%d-%H%M',time.gmtime(_creation))}-{_j}",_creation,str(_random.getrandbits(63)),_random.randint(0,10**9)))
+        _rolledback = []
+        if _random.random() < rollback and len(_snaps) > 4: ## die letzten snapshots der quelle wurden per rollback entfernt
+            _rolledback = _snaps[-3:]
+            _snaps = _snaps[:-3]
+        _dataset("local",_name,_dstype,autosnapshot="true" if _i % 10 == 0 else "-",checkzfs="ignore" if _i % 97 == 96 else "-")
+        for _snap in _snaps:
+            _snapshot("local",_name,_snap)
+        for _host in _replicas:
+            if _random.random() >= overlap:
+                continue
+            _replica = f"tank/replica/vm-{_i}-disk-{_i % 3}"
+            _dataset(_host,_replica,_dstype,autosnapshot="false")
+            for _snap in _snaps[:len(_snaps) - _random.randint(0,2)] + _rolledback:
+                _snapshot(_host,_replica,_snap)
+    os.makedirs(datadir,exist_ok=True)
+    _rows = 0
+    for _host,_lines in _hosts.items():
+        with open(os.path.join(datadir,f"{_host}.tsv"),"wt") as _f:
+            _f.write("\t".join(FIELDS) + "\n")
+            for _line in _lines:
+                _f.write("\t".join(_line) + "\n")
+        _rows += len(_lines)
+    return _replicas, _rows
+
+def install_fakes(bindir):
+    os.makedirs(bindir,exist_ok=True)
+    for _name,_script in (("zfs",FAKE_ZFS),("ssh",FAKE_SSH)):
+        _path = os.path.join(bindir,_name)
+        with open(_path,"wt") as _f:
+            _f.write(_script)
+        os.chmod(_path,0o755)
+
+def load_checkzfs(path):
+    _spec = importlib.util.spec_from_file_location("checkzfs",path)
+    _module = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(_module)
+    return _module
+
+def checkzfs_kwargs(**kwargs):
+    ## gleiche argumente wie der argparser von checkzfs, output "bench" damit __init__ nur die daten holt
+    _kwargs = dict(remote=None,source=None,sourceonly=False,legacyhosts=None,output="bench",ignoreattr="tv.sysops:checkzfs",mail=None,prefix="REPLICA",debug=False,
+                filter=None,snapshotfilter=None,replicafilter=None,columns=None,sort=None,threshold=None,maxsnapshots=None,rawdata=False,
+                agenthosts=None,compress=None,timeout=None,ssh_identity=None,piggyback="",ssh_extra_options=None,ssh_persist=None,
+                cachedir=None,cached=None,cached_refresh=False,daemon=None,interval=None)
+    _kwargs.update(kwargs)
+    return _kwargs
+
+class benchmark(object):
+    def __init__(self,memory=False,repeat=1):
+        self.memory = memory
+        self.repeat = max(1,repeat)
+        self.results = []
+
+    def measure(self,phase,func,count=None,repeat=None,wire=None):
+        ## count(ergebnis) -> anzahl verarbeiteter einträge für den durchsatz, bei wiederholung zählt die schnellste
+        ## wire(ergebnis) -> übertragene bytes der remote hosts
+        _elapsed = float("inf")
+        if self.memory:
+            tracemalloc.start()
+        for _ in range(repeat or self.repeat):
+            _result = None
+            gc.collect()
+            _start = time.perf_counter()
+            _result = func()
+            _elapsed = min(_elapsed,time.perf_counter() - _start)
+        _peak = None
+        if self.memory:
+            _peak = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+        _items = count(_result) if count else None
+        self.results.append({
+            "phase"     : phase,
+            "seconds"   : round(_elapsed,4),
+            "items"     : _items,
+            "per_sec"   : int(_items / _elapsed) if _items and _elapsed > 0 else None,
+            "peak_kb"   : _peak,
+            "maxrss_kb" : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "wire_bytes": wire(_result) if wire else None,
+        })
+        print(self.format_result(self.results[-1]),file=sys.stderr)
+        return _result
+
+    @staticmethod
+    def format_result(result):
+        _line = f"{result['phase']:<28} {result['seconds']:>9.3f} s"
+        _line += f" {result['per_sec']:>12,}/s" if result["per_sec"] else " " * 14
+        _line += f" {result['peak_kb']:>10,} KB peak" if result["peak_kb"] is not None else ""
+        _line += f" {result['maxrss_kb']:>10,} KB rss"
+        _line += f" {result['wire_bytes']:>14,} bytes ssh" if result.get("wire_bytes") is not None else ""
+        return _line
+
+def startup(bench,checkzfs,tmpdir,repeat,budget):
+    ## interpreter start, deaktivierte config und --help als eigener prozess wie beim checkmk agent
+    ## budget in ms für den deaktivierten aufruf zusätzlich zum leeren interpreter, None wenn eingehalten
+    _config = os.path.join(tmpdir,"disabled.cfg")
+    with open(_config,"wt") as _f:
+        _f.write("disabled: 1\n")
+    _run = lambda *args: subprocess.run([sys.executable] + list(args),stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL,check=True)
+    bench.measure("startup[python]",lambda: _run("-c","pass"),repeat=repeat)
+    bench.measure("startup[disabled]",lambda: _run(checkzfs,"--config",_config),repeat=repeat)
+    _overhead = (bench.results[-1]["seconds"] - bench.results[-2]["seconds"]) * 1000
+    bench.measure("startup[help]",lambda: _run(checkzfs,"--help"),repeat=repeat)
+    print(f"startup overhead {_overhead:.1f} ms (budget {budget:g} ms)",file=sys.stderr)
+    return _overhead if _overhead > budget else None
+
+def run(args):
+    _checkzfs_path = os.path.abspath(args.checkzfs)
+    _tmpdir = args.keep or tempfile.mkdtemp(prefix="checkzfs-bench-")
+    _bindir = os.path.join(_tmpdir,"bin")
+    _datadir = os.path.join(_tmpdir,"data")
+    _bench = benchmark(memory=args.memory,repeat=args.repeat)
+    _checkzfs = None
+    _over_budget = None
+    try:
+        install_fakes(_bindir)
+        _replicas, _rows = _bench.measure("generate",lambda: generate(_datadir,args.datasets,args.snapshots,args.hosts,args.overlap,args.rollback,args.seed),lambda r: r[1],repeat=1)
+        os.environ["PATH"] = _bindir + os.pathsep + os.environ.get("PATH","")
+        os.environ["FAKEZFS_DIR"] = _datadir
+        os.environ["FAKESSH_LATENCY"] = str(args.latency)
+        _over_budget = startup(_bench,_checkzfs_path,_tmpdir,max(args.repeat,5),args.startup_budget)
+        _checkzfs = _bench.measure("import",lambda: load_checkzfs(_checkzfs_path),repeat=1)
+        _remote = ",".join(_replicas)
+        _modes = args.modes.split(",")
+        _check = None
+        for _mode in _modes:
+            _options = {"plain": {}, "agent": {"agenthosts": _remote}, "compress": {"agenthosts": _remote, "compress": "1"}, "legacy": {"legacyhosts": _remote}}.get(_mode)
+            if _options is None:
+                raise Exception(f"unbekannter modus {_mode}")
+            _obj = _bench.measure(f"get_data[{_mode}]",lambda: _checkzfs.zfscheck(**checkzfs_kwargs(remote=_remote,**_options)),lambda o: o._stats["rows"],
+                        wire=lambda o: sum(_stats["bytes"] for _host,_stats in o._host_stats.items() if _host)) ## nur replika hosts gehen über ssh
+            if _obj.host_errors:
+                raise Exception(f"fehler bei der abfrage: {_obj.host_errors}")
+            _check = _check or _obj
+        _bench.measure("_call_proc[local]",lambda: sum(1 for _ in _check._call_proc(None)),lambda r: r)
+        if _replicas:
+            _bench.measure(f"_call_proc[{_replicas[0]}]",lambda: sum(1 for _ in _check._call_proc(_replicas[0])),lambda r: r)
+        _lines = list(_check._call_proc(None))
+        _bench.measure("_parse",lambda: sum(1 for _ in _check._parse(_lines)),lambda r: r)
+        del _lines
+        _data = _bench.measure("get_output",_check.get_output,len)
+        _bench.measure("get_snaplist",_check.get_snaplist,lambda r: sum(len(_ds.snapshots) for _ds in _check.ZFS_DATASETS.values() if _ds.is_source))
+        for _output,_renderer in (("text",_check.table_output),("html",_check.html_output),("csv",_check.csv_output),("json",_check.json_output),("checkmk",_check.checkmk_output)):
+            _check.columns = _check._default_columns(_output)
+            _bench.measure(_renderer.__name__,lambda: _renderer(_data),lambda r: len(_data))
+    finally:
+        if not args.keep:
+            shutil.rmtree(_tmpdir,ignore_errors=True)
+    return {
+        "checkzfs"  : getattr(_checkzfs,"VERSION",None),
+        "params"    : {"datasets": args.datasets, "snapshots": args.snapshots, "hosts": args.hosts, "overlap": args.overlap, "rollback": args.rollback, "latency": args.latency, "rows": _rows},
+        "results"   : _bench.results,
+        "startup_over_budget" : _over_budget,
+    }
+
+def compare(current,previous,tolerance):
+    ## zeit und speicher pro phase gegen ein gespeichertes ergebnis, True wenn eine phase schlechter als die toleranz ist
+    _previous = {_result["phase"]:_result for _result in previous["results"]}
+    if current["params"] != previous["params"]:
+        print(f"ACHTUNG: andere parameter {previous['params']}",file=sys.stderr)
+    _regression = False
+    print(f"{'phase':<28} {'vorher':>9} {'jetzt':>9}  faktor  {'bytes vorher':>14} {'bytes jetzt':>14}")
+    for _result in current["results"]:
+        _old = _previous.get(_result["phase"])
+        if not _old or _result["phase"] in ("generate",):
+            continue
+        _factor = _result["seconds"] / _old["seconds"] if _old["seconds"] else 1.0
+        _flag = ""
+        if _factor > 1 + tolerance and _result["seconds"] - _old["seconds"] > 0.01: ## sehr kurze phasen schwanken zu stark
+            _flag = " REGRESSION"
+        if _result["peak_kb"] and _old.get("peak_kb") and _result["peak_kb"] > _old["peak_kb"] * (1 + tolerance):
+            _flag += " MEMORY"
+        _bytes = ""
+        if _result.get("wire_bytes") is not None and _old.get("wire_bytes") is not None:
+            _bytes = f"  {_old['wire_bytes']:>14,} {_result['wire_bytes']:>14,}"
+            if _result["wire_bytes"] > _old["wire_bytes"] * (1 + tolerance):
+                _flag += " BYTES"
+        _regression = _regression or bool(_flag)
+        print(f"{_result['phase']:<28} {_old['seconds']:>9.3f} {_result['seconds']:>9.3f}  {_factor:5.2f}{_bytes}{_flag}")
+    return _regression
+
+if __name__ == "__main__":
+    _parser = argparse.ArgumentParser(description="checkzfs benchmark mit synthetischen pools und fake zfs/ssh")
+    _parser.add_argument("--checkzfs",type=str,default=os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","checkzfs.py"),
+                help="zu messendes checkzfs script")
+    _parser.add_argument("--datasets",type=int,default=500,
+                help="Anzahl Datasets auf der Quelle")
+    _parser.add_argument("--snapshots",type=int,default=100,
+                help="Snapshots pro Dataset")
+    _parser.add_argument("--hosts",type=int,default=2,
+                help="Anzahl Hosts inkl. Quelle")
+    _parser.add_argument("--overlap",type=float,default=0.9,
+                help="Anteil der Datasets die auf jedem Replika Host vorhanden sind")
+    _parser.add_argument("--rollback",type=float,default=0.02,
+                help="Anteil der Datasets mit Rollback auf der Quelle")
+    _parser.add_argument("--latency",type=float,default=0.0,
+                help="ssh Verbindungsaufbau in Sekunden")
+    _parser.add_argument("--modes",type=str,default="plain",
+                help="Abfragearten für get_data: plain,agent,compress,legacy")
+    _parser.add_argument("--repeat",type=int,default=3,
+                help="jede Phase mehrfach messen, die schnellste zählt")
+    _parser.add_argument("--startup-budget",type=float,default=80,metavar="ms",
+                help="erlaubte Startzeit für eine deaktivierte config über dem leeren Interpreter, exit 1 wenn überschritten")
+    _parser.add_argument("--seed",type=int,default=1)
+    _parser.add_argument("--memory",action="store_true",
+                help="Spitzenverbrauch pro Phase mit tracemalloc messen (langsamer)")
+    _parser.add_argument("--save",type=str,metavar="file",
+                help="Ergebnis als json speichern")
+    _parser.add_argument("--compare",type=str,metavar="file",
+                help="mit gespeichertem Ergebnis vergleichen, exit 1 bei Regression")
+    _parser.add_argument("--tolerance",type=float,default=0.2,
+                help="erlaubte Verschlechterung beim Vergleich (0.2 = 20%%)")
+    _parser.add_argument("--keep",type=str,metavar="dir",
+                help="fake binaries und daten in dir erzeugen und behalten")
+    args = _parser.parse_args()
+    _result = run(args)
+    if args.save:
+        with open(args.save,"wt") as _f:
+            json.dump(_result,_f,indent=2)
+    _failed = _result["startup_over_budget"] is not None
+    if args.compare:
+        with open(args.compare,"rt") as _f:
+            _failed = compare(_result,json.load(_f),args.tolerance) or _failed
+    sys.exit(1 if _failed else 0)
@@ -33,54 +33,67 @@ VERSION = 4.14
 ### ssh-extra-options:              # [optional] comma seperated ssh options like added with -o 
 ### ssh-identity: /path/to/priv.key # [optional] path to ssh private key
 ### disabled: 1                     # [optional] disable the script with this config 
-### legacyhosts: host1              # [optional] use an external script zfs_legacy_list to get snapshots with guid and creation at lease
+### legacyhosts: host1              # [optional] hosts without zfs list -p / written attribute, listed with one recursive zfs get
+### agenthosts: host1               # [optional] run checkzfs itself on these hosts (python3 via ssh) and transfer a compact listing
+### compress: 1                     # [optional] agenthosts send a delta encoded, zlib compressed binary listing
+### batch: 1                        # [optional] only in /etc/check_mk/checkzfs: also run checkzfs2, checkzfs3 ... configs in this run, each host is queried once
+###                                 #            the checkzfs2 ... plugin links then exit immediately
+### selfcheck: 30,50                # [optional] checkmk service <prefix>:checkzfs_self with runtime/bytes/rows per host, warn,crit on runtime in seconds
+### timeout: 60                     # [optional] timeout in seconds per host for zfs list / ssh
+### ssh-persist: 300                # [optional] keep ssh connection open for reuse (ControlPersist) in seconds, 0 disables
+### client: /run/checkzfs.sock     # [optional] get the output from a running checkzfs --daemon /run/checkzfs.sock
+### cached: 300                     # [optional] checkmk output from cache (local check cached()), refreshed in background when older
+### cachedir: /var/lib/checkzfs     # [optional] keep inventory between runs, only list snapshots of datasets with changed snapshots_changed (OpenZFS 2.2+)
+###                                 #            and the replicated bytes per run for the throughput/eta columns
+### retention: hourly=24:2h,daily=7:26h # [optional] per label (frequent,hourly,daily,weekly,monthly,yearly,backup-zfs,bashclub-zfs,other) expected count:max age
+###                                 #            of the newest snapshot as checkmk services <prefix>:<dataset>@<label>, all labels with --output retention
+### keep-history: 30                # [optional] record age/count/used/pending per source/replica every run in <cachedir>/history.sqlite, keep x days
+###                                 #            query with checkzfs --history 1d
+### zabbix-sender: /var/lib/checkzfs/zabbix.sender # [optional] with --output zabbix (default in /zabbix/scripts when set) print the low level discovery json
+###                                 #            and write all item values of the run as one zabbix_sender input file (zabbix_sender -T -i file)
 
 ## Regex Tips: 
 ## 'Raid5[ab]\/(?!Rep_|Swap-)\w+' everything from Raid5a or Raid5b not start with Rep_ or Swap-
+## filter/replicafilter as plain dataset path anchored at the pool with # or ^ (like '#rpool/data/|#tank/backup/') only lists these subtrees with zfs list -r
+##   '#rpool/data/' -> rpool/data   '#rpool/data' -> rpool (also matches rpool/data2)   '#rpool/data$' -> only rpool/data
+##   filters are matched against host#dataset, without anchor 'rpool/data' also matches tank/backup/rpool/data and everything is listed
 
 
-##
-##!/bin/bash
-## legacy script example to put in path as zfs_legacy_list to for host with missing written attribute and list option -p
-# for snapshot in $(zfs list -H -t all -o name);
-# do
-#     echo -ne "$snapshot"
-#     zfs get -H -p type,creation,guid,used,available,userrefs,com.sun:auto-snapshot,tv.sysops:checkzfs $snapshot |  awk '{print $3}'|
-#         while IFS= read -r line; do
-#             echo -ne "\t${line}"
-#         done
-#     echo  ""
-# done
-
-from pprint import pprint
 import sys
 import re
 import subprocess
 import time
-import json
 import os.path
 import os
-import socket
-from email.message import EmailMessage
-from email.mime.application import MIMEApplication
-from email.utils import formatdate
+import shlex
+import contextlib
+import itertools
+import zlib
+import threading
 
 _ = lambda x: x   ## inline translate ... maybe later
 
 class zfs_snapshot(object):
+    ## __slots__ statt __dict__ und namen interned (gleicher name auf source und replica nur einmal im speicher)
+    ## 200k snapshots mit replikat: ~498 bytes pro snapshot (__dict__), ~325 bytes mit slots, intern und age als property
+    __slots__ = ("replica","dataset_obj","snapshot","creation","written","origin","guid")
     def __init__(self,dataset_obj,snapshot,creation,guid,written,origin,**kwargs):
-        self.replica = []
+        self.replica = ()
         self.dataset_obj = dataset_obj
-        self.snapshot = snapshot
+        self.snapshot = sys.intern(snapshot)
         self.creation = int(creation)
-        self.age = int(time.time() - self.creation)
         self.written = int(written)
-        self.origin = origin
-        self.guid = guid
+        self.origin = sys.intern(origin)
+        self.guid = sys.intern(guid)
+
+    @property
+    def age(self):
+        return int(time.time() - self.creation)
 
     def add_replica(self,snapshot):
-            self.replica.append(snapshot) ## den snapshot als replica hinzu
+            self.replica += (snapshot,) ## den snapshot als replica hinzu (tuple, meist nur 1-2 replikate)
             self.dataset_obj.add_replica(snapshot.dataset_obj) ## als auch dem dataset
+            snapshot.dataset_obj.add_common(self.dataset_obj,snapshot) ## replica merkt sich den neuesten gemeinsamen snapshot
 
     def __repr__(self):
         return f"{self.guid} {self.dataset_obj.dataset_name} {self.snapshot}\n"
@@ -91,6 +104,9 @@ class zfs_snapshot(object):
 
 
 class zfs_dataset(object):
+    ## indizes werden beim hinzufügen gepflegt, die auswertung muss dann nicht mehr sortieren/suchen
+    __slots__ = ("checkzfs","snapshots","remote","is_source","guid","dataset","creation","autosnapshot","type","used","available","replica","lastsnapshot",
+                 "_ordered","_unordered","_latest","_common","_autosnapshots","_written")
     def __init__(self,dataset,guid,used,available,creation,type,autosnapshot,checkzfs,remote=None,source=None,**kwargs):
         self.checkzfs = checkzfs not in ("false","ignore")  ## ignore wenn tv.sysops:checkzfs entweder false oder ignore (ignore macht es überischtlicher)
         self.snapshots = {}
@@ -100,28 +116,63 @@ class zfs_dataset(object):
         self.dataset = dataset
         self.creation = creation = int(creation)
         self.autosnapshot = {"true":2,"false":0}.get(autosnapshot,1) ### macht für crit/warn/ok am meisten sinn so
-        self.type = type
+        self.type = sys.intern(type)
         self.used = int(used)
         self.available = int(available)
         self.replica = set()
         self.lastsnapshot = ""
+        self._ordered = [] ## snapshots nach creation (zfs list liefert sie schon so)
+        self._unordered = False
+        self._latest = None ## neuester snapshot
+        self._common = {} ## source dataset -> neuester gemeinsamer snapshot
+        self._autosnapshots = 0 ## anzahl zfs-auto-snap_ snapshots
+        self._written = None ## guid -> summe written bis einschließlich diesem snapshot, erst bei bedarf
 
     def add_snapshot(self,**kwargs):
         _obj = zfs_snapshot(self,**kwargs) ## neuen snapshot mit parametern erstellen
         self.snapshots[_obj.guid] = _obj ## zu lokalen snapshots diesem DS hinzu
+        if self._ordered and _obj.creation < self._ordered[-1].creation:
+            self._unordered = True ## wird erst bei bedarf sortiert
+        self._ordered.append(_obj)
+        if self._latest is None or _obj.creation > self._latest.creation:
+            self._latest = _obj
+        if _obj.snapshot.startswith("zfs-auto-snap_"):
+            self._autosnapshots += 1
+        self._written = None
         return _obj ## snapshot objeckt zurück
 
     def add_replica(self,ds_object,**kwargs):
         self.replica.add(ds_object) 
 
+    def add_common(self,source,snapshot): ## snapshot dieses datasets ist auch auf source vorhanden
+        _common = self._common.get(source)
+        if _common is None or snapshot.creation > _common.creation:
+            self._common[source] = snapshot
+
     def _get_latest_snapshot(self,source=None):
-        _snapshots = self.sorted_snapshots()
         if source: ## wenn anderes dataset übergeben dann nur snapshots zurück die auch auf der anderen seite (mit gleicher guid) vorhanden sind
-            _snapshots = list(filter(lambda x: x.guid in source.snapshots.keys(),_snapshots))
-        return _snapshots[0] if _snapshots else None ## letzten gemeinsamen snapshot zurück 
+            return self._common.get(source) ## letzten gemeinsamen snapshot zurück 
+        return self._latest
+
+    def ordered_snapshots(self): ## snapshots nach creation aufsteigend
+        if self._unordered:
+            self._ordered.sort(key=lambda x: x.creation)
+            self._unordered = False
+        return self._ordered
+
+    def written_since(self,snapshot): ## summe written aller snapshots neuer als snapshot (None = alle), präfixsummen einmal pro dataset
+        if self._written is None:
+            _sum = 0
+            self._written = {}
+            for _snapshot in self.ordered_snapshots():
+                _sum += _snapshot.written
+                self._written[_snapshot.guid] = _sum
+            self._written[None] = 0
+        _total = self._written.get(self._ordered[-1].guid,0) if self._ordered else 0
+        return _total - self._written.get(snapshot.guid if snapshot else None,0)
 
     def sorted_snapshots(self):
-        return sorted(self.snapshots.values(), key=lambda x: x.age) ## snapshots nach alter sortiert
+        return self.ordered_snapshots()[::-1] ## snapshots nach alter sortiert
 
     @property
     def dataset_name(self): ## namen mit host prefixen
@@ -131,91 +182,167 @@ class zfs_dataset(object):
 
     @property
     def latest_snapshot(self): ## letzten snapshot
-        if self.snapshots:
-            return self.sorted_snapshots()[0]
+        return self._latest
 
 
-    def get_info(self,source,threshold=None,maxsnapshots=None,ignore_replica=False):
-        _latest = self._get_latest_snapshot(source if source != self else None) ## wenn das source dataset nicht man selber ist
-        _status = -1
-        _has_zfs_autosnapshot = any(map(lambda x: str(x.snapshot).startswith("zfs-auto-snap_"),self.snapshots.values()))
-        _message = ""
-        if source == self:
-            if not self.replica and ignore_replica == False:
-                _status = 1 ## warn
-                _message = _("kein Replikat gefunden")
-            if self.autosnapshot == 2 and _has_zfs_autosnapshot:
-                _status = 1 ## warn
-                _message = _("com.sun:auto-snapshot ist auf der Quelle auf true und wird evtl. mit repliziert")
-        else:
-            if _has_zfs_autosnapshot:  ## nur auf systemen mit zfs-aut-snapshot
-                if self.autosnapshot == 1:
-                    _status = 1 ## warn
-                    _message = _("com.sun:auto-snapshot ist nicht false")
-                elif self.autosnapshot == 2:
-                    _status = 2 ## crit
-                    _message = _("com.sun:auto-snapshot ist auf Replikationspartner aktiviert")
-
-        if _latest:
-            _threshold_status = ""
-            _age = _latest.age / 60 ## in minuten
-            if threshold:
-                _threshold_status = list(
-                    map(lambda x: x[1], ## return only last
-                        filter(lambda y: y[0] < _age, ## check threshold Texte
-                            zip(threshold,(1,2)) ## warn 1 / crit 2
-                        )
-                    )
-                )
-            if not _threshold_status:
-                if _status == -1:
-                    _status = 0 ## ok
-            else:
-                _message = _("Snapshot ist zu alt")
-                _status = _threshold_status[-1]
-            if _latest != self.latest_snapshot:
-                _message = _("Rollback zu altem Snapshot. - '{0.snapshot}' nicht mehr vorhanden".format(self.latest_snapshot))
-                _status = 2 ## crit
-
-        if maxsnapshots:
-            _maxsnapshot_status = list(
-                map(lambda x: x[1],
-                    filter(lambda y: y[0] < len(self.snapshots.keys()),
-                        zip(maxsnapshots,(1,2))
-                    )
-                )
-            )
-            if _maxsnapshot_status:
-                if _maxsnapshot_status[-1] > _status:
-                    _message = _("zu viele Snapshots")
-                    _status = _maxsnapshot_status[-1]
-        if not self.checkzfs:
-            _status = -1
+    def get_info(self,source,threshold=None,maxsnapshots=None,ignore_replica=False): ## status und spalten für ein paar, die regeln stehen nur in status_evaluator
+        return status_evaluator(threshold=threshold,maxsnapshots=maxsnapshots,ignore_replica=ignore_replica).evaluate([(self,source)])[0]
 
-        return {  ## neues object zurück was die attribute enthält die wir über columns ausgeben
-            "source"        : source.dataset_name if source else "",
-            "replica"       : self.dataset_name if source != self else "",
-            "type"          : self.type,
-            "autosnapshot"  : self.autosnapshot,
-            "used"          : self.used,
-            "available"     : self.available,
-            "creation"      : (_latest.creation if _latest else 0) if source != self else self.creation,
-            "count"         : len(self.snapshots.keys()),
-            "snapshot"      : _latest.snapshot if _latest else "",
-            "age"           : _latest.age if _latest else 0,
-            "written"       : _latest.written if _latest else 0,
-            "origin"        : _latest.origin if _latest else "",
-            "guid"          : _latest.guid if _latest else "",
-            "status"        : _status,
-            "message"       : _message
-        }
-        
     def __repr__(self):
         return f"{self.is_source}-{self.dataset_name:25.25}{self.type}\n"
 
     def __str__(self):
         return f"{self.dataset:25.25}{self.type}  -snapshots: {self.lastsnapshot}\n"
 
+class status_evaluator(object):
+    ## status/message für viele datasets in einem durchgang, die einzige stelle mit den status regeln (zfs_dataset.get_info ruft nur evaluate auf)
+    ## fakten werden als spalten gesammelt, ab NUMPY_MIN_ROWS mit numpy (wenn installiert) sonst in einer schleife ohne lambdas
+    NUMPY_MIN_ROWS = 2000 ## darunter lohnt der import von numpy nicht
+    MESSAGES = (
+        "",
+        _("kein Replikat gefunden"),
+        _("com.sun:auto-snapshot ist auf der Quelle auf true und wird evtl. mit repliziert"),
+        _("com.sun:auto-snapshot ist nicht false"),
+        _("com.sun:auto-snapshot ist auf Replikationspartner aktiviert"),
+        _("Snapshot ist zu alt"),
+        None, ## rollback, text mit snapshot name
+        _("zu viele Snapshots"),
+    )
+    def __init__(self,threshold=None,maxsnapshots=None,ignore_replica=False,rates=None):
+        self.threshold = threshold
+        self.maxsnapshots = maxsnapshots
+        self.ignore_replica = ignore_replica
+        self.rates = rates or {} ## (source,replica) -> bytes/s aus zfscheck._update_rates
+
+    def evaluate(self,pairs): ## [(dataset,source)] -> liste von dicts mit den VALIDCOLUMNS schlüsseln
+        _now = time.time()
+        _columns = {_key:[] for _key in ("is_source","has_replica","autosnapshot","has_autosnapshot","has_latest","age","rollback","count","checkzfs")}
+        _latests = []
+        for _dataset,_source in pairs:
+            _is_source = _source == _dataset
+            _latest = _dataset._get_latest_snapshot(None if _is_source else _source)
+            _latests.append(_latest)
+            _columns["is_source"].append(_is_source)
+            _columns["has_replica"].append(bool(_dataset.replica))
+            _columns["autosnapshot"].append(_dataset.autosnapshot)
+            _columns["has_autosnapshot"].append(_dataset._autosnapshots > 0)
+            _columns["has_latest"].append(_latest is not None)
+            _columns["age"].append(int(_now - _latest.creation) if _latest else 0)
+            _columns["rollback"].append(_latest is not None and _latest != _dataset._latest)
+            _columns["count"].append(len(_dataset.snapshots))
+            _columns["checkzfs"].append(_dataset.checkzfs)
+        if len(pairs) >= self.NUMPY_MIN_ROWS:
+            try:
+                import numpy
+            except ImportError:
+                numpy = None
+        else:
+            numpy = None
+        _status, _codes = self._evaluate_numpy(numpy,_columns) if numpy else self._evaluate_python(_columns)
+        _output = []
+        for (_dataset,_source),_latest,_state,_code,_age in zip(pairs,_latests,_status,_codes,_columns["age"]):
+            _is_source = _source == _dataset
+            _message = self.MESSAGES[_code] if _code != 6 else _("Rollback zu altem Snapshot. - '{0.snapshot}' nicht mehr vorhanden".format(_dataset._latest))
+            _pending = _source.written_since(_latest) if not _is_source else 0
+            _throughput = self.rates.get((_source.dataset_name,_dataset.dataset_name),"") if not _is_source else ""
+            _eta = ("" if not _throughput else int(_pending / _throughput)) if _pending else (0 if not _is_source else "")
+            _output.append({ ## spalten wie VALIDCOLUMNS
+                "source"        : _source.dataset_name if _source else "",
+                "replica"       : _dataset.dataset_name if not _is_source else "",
+                "type"          : _dataset.type,
+                "autosnapshot"  : _dataset.autosnapshot,
+                "used"          : _dataset.used,
+                "available"     : _dataset.available,
+                "creation"      : (_latest.creation if _latest else 0) if not _is_source else _dataset.creation,
+                "count"         : len(_dataset.snapshots),
+                "snapshot"      : _latest.snapshot if _latest else "",
+                "age"           : _age,
+                "written"       : _latest.written if _latest else 0,
+                "origin"        : _latest.origin if _latest else "",
+                "guid"          : _latest.guid if _latest else "",
+                "pending"       : _pending,
+                "throughput"    : _throughput,
+                "eta"           : _eta,
+                "status"        : int(_state),
+                "message"       : _message
+            })
+        return _output
+
+    def _evaluate_python(self,columns):
+        _threshold = self.threshold
+        _maxsnapshots = self.maxsnapshots
+        _ignore_replica = self.ignore_replica
+        _status = []
+        _codes = []
+        for _is_source,_has_replica,_autosnapshot,_has_autosnapshot,_has_latest,_age,_rollback,_count,_checkzfs in zip(*columns.values()):
+            _state = -1
+            _code = 0
+            if _is_source:
+                if not _has_replica and not _ignore_replica:
+                    _state, _code = 1, 1
+                if _autosnapshot == 2 and _has_autosnapshot:
+                    _state, _code = 1, 2
+            elif _has_autosnapshot:
+                if _autosnapshot == 1:
+                    _state, _code = 1, 3
+                elif _autosnapshot == 2:
+                    _state, _code = 2, 4
+            if _has_latest:
+                _minutes = _age / 60
+                _threshold_state = (2 if _threshold[1] < _minutes else 1 if _threshold[0] < _minutes else 0) if _threshold else 0
+                if not _threshold_state:
+                    if _state == -1:
+                        _state = 0
+                else:
+                    _state, _code = _threshold_state, 5
+                if _rollback:
+                    _state, _code = 2, 6
+            if _maxsnapshots:
+                _max_state = 2 if _maxsnapshots[1] < _count else 1 if _maxsnapshots[0] < _count else 0
+                if _max_state and _max_state > _state:
+                    _state, _code = _max_state, 7
+            if not _checkzfs:
+                _state = -1
+            _status.append(_state)
+            _codes.append(_code)
+        return _status, _codes
+
+    def _evaluate_numpy(self,numpy,columns):
+        _is_source = numpy.array(columns["is_source"],dtype=bool)
+        _has_replica = numpy.array(columns["has_replica"],dtype=bool)
+        _autosnapshot = numpy.array(columns["autosnapshot"],dtype=numpy.int8)
+        _has_autosnapshot = numpy.array(columns["has_autosnapshot"],dtype=bool)
+        _has_latest = numpy.array(columns["has_latest"],dtype=bool)
+        _minutes = numpy.array(columns["age"],dtype=numpy.float64) / 60
+        _rollback = numpy.array(columns["rollback"],dtype=bool)
+        _count = numpy.array(columns["count"],dtype=numpy.float64)
+        _status = numpy.full(len(_is_source),-1,dtype=numpy.int8)
+        _codes = numpy.zeros(len(_is_source),dtype=numpy.int8)
+        def _set(mask,state,code): ## spätere regeln überschreiben frühere
+            _status[mask] = state
+            _codes[mask] = code
+        if not self.ignore_replica:
+            _set(_is_source & ~_has_replica,1,1)
+        _set(_is_source & (_autosnapshot == 2) & _has_autosnapshot,1,2)
+        _set(~_is_source & _has_autosnapshot & (_autosnapshot == 1),1,3)
+        _set(~_is_source & _has_autosnapshot & (_autosnapshot == 2),2,4)
+        if self.threshold:
+            _threshold_state = numpy.where(_minutes > self.threshold[1],2,numpy.where(_minutes > self.threshold[0],1,0))
+        else:
+            _threshold_state = numpy.zeros(len(_is_source),dtype=numpy.int8)
+        _status[_has_latest & (_threshold_state == 0) & (_status == -1)] = 0
+        _too_old = _has_latest & (_threshold_state > 0)
+        _status[_too_old] = _threshold_state[_too_old]
+        _codes[_too_old] = 5
+        _set(_has_latest & _rollback,2,6)
+        if self.maxsnapshots:
+            _max_state = numpy.where(_count > self.maxsnapshots[1],2,numpy.where(_count > self.maxsnapshots[0],1,0))
+            _too_many = (_max_state > 0) & (_max_state > _status)
+            _status[_too_many] = _max_state[_too_many]
+            _codes[_too_many] = 7
+        _status[~numpy.array(columns["checkzfs"],dtype=bool)] = -1
+        return _status.tolist(), _codes.tolist()
+
 class no_regex_class(object):
     def search(*args):
         return True
@@ -226,12 +353,155 @@ class negative_regex_class(object):
     def search(self,text):
         return not self.regex.search(text)
 
+class phase_profiler(object):
+    ## zeiten pro phase (wall/cpu), zähler wie rows/bytes und netto allokierte speicherblöcke für --profile
+    ## ausgabe im chrome trace format (chrome://tracing, ui.perfetto.dev), zusätzlich "phases" als zusammenfassung
+    ## hook "cprofile:phase[:host]" oder "tracemalloc:phase[:host]" misst genau eine phase genauer
+    def __init__(self,enabled=True,hook=None):
+        self.enabled = enabled ## ohne --profile nichts sammeln (daemon läuft dauerhaft)
+        self.events = []
+        self.hooks = []
+        self._start = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._hook = None
+        if hook:
+            _kind, _phase, _host = (hook.split(":",2) + ["",""])[:3]
+            if _kind not in ("cprofile","tracemalloc") or not _phase:
+                raise Exception(_("ungültiger profile hook {0} (cprofile:phase[:host] oder tracemalloc:phase[:host])").format(hook))
+            self._hook = (_kind,_phase,_host or None)
+        self._hook_active = False
+
+    @contextlib.contextmanager
+    def phase(self,name,host=None,**args):
+        _event = {"name":name,"host":host,"args":dict(args)}
+        if not self.enabled:
+            yield _event
+            return
+        _stack = self._local.__dict__.setdefault("stack",[])
+        _stack.append(_event)
+        _hook = self._hook_start(name,host)
+        _blocks = sys.getallocatedblocks()
+        _cpu = time.thread_time()
+        _wall = time.perf_counter()
+        try:
+            yield _event
+        finally:
+            _event["wall"] = time.perf_counter() - _wall
+            _event["cpu"] = time.thread_time() - _cpu
+            _event["blocks"] = sys.getallocatedblocks() - _blocks ## prozessweit, parallele threads zählen mit
+            _event["start"] = _wall - self._start
+            _event["thread"] = threading.get_ident()
+            if _hook:
+                self._hook_stop(_hook,name,host)
+            _stack.pop()
+            with self._lock:
+                self.events.append(_event)
+
+    def count(self,**counters): ## zähler zur innersten laufenden phase im aktuellen thread addieren
+        _stack = getattr(self._local,"stack",None)
+        if _stack:
+            _args = _stack[-1]["args"]
+            for _key,_value in counters.items():
+                _args[_key] = _args.get(_key,0) + _value
+
+    def timed(self,iterable,counter): ## zeit im iterator (warten auf zfs/ssh + parsen) als zähler der phase
+        _iterator = iter(iterable)
+        _total = 0.0
+        try:
+            while True:
+                _start = time.perf_counter()
+                try:
+                    _item = next(_iterator)
+                except StopIteration:
+                    return
+                finally:
+                    _total += time.perf_counter() - _start
+                yield _item
+        finally:
+            self.count(**{counter:round(_total,6)})
+
+    def _hook_start(self,name,host):
+        if not self._hook or self._hook[1] != name or self._hook[2] not in (None,host):
+            return None
+        with self._lock: ## cprofile/tracemalloc nur einmal gleichzeitig
+            if self._hook_active:
+                return None
+            self._hook_active = True
+        if self._hook[0] == "cprofile":
+            import cProfile
+            _profile = cProfile.Profile()
+            _profile.enable()
+            return _profile
+        import tracemalloc
+        tracemalloc.start()
+        return tracemalloc
+
+    def _hook_stop(self,hook,name,host):
+        import io
+        _output = io.StringIO()
+        if self._hook[0] == "cprofile":
+            import pstats
+            hook.disable()
+            pstats.Stats(hook,stream=_output).sort_stats("cumulative").print_stats(30)
+        else:
+            _snapshot = hook.take_snapshot()
+            _current, _peak = hook.get_traced_memory()
+            hook.stop()
+            _output.write(f"current {_current} bytes / peak {_peak} bytes\n")
+            for _stat in _snapshot.statistics("lineno")[:30]:
+                _output.write(f"{_stat}\n")
+        self.hooks.append({"hook":self._hook[0],"phase":name,"host":host,"report":_output.getvalue()})
+        with self._lock:
+            self._hook_active = False
+
+    def summary(self):
+        _phases = {}
+        for _event in self.events:
+            _key = (_event["name"],_event["host"])
+            _phase = _phases.setdefault(_key,{"phase":_event["name"],"host":_event["host"],"count":0,"wall":0.0,"cpu":0.0,"blocks":0})
+            _phase["count"] += 1
+            _phase["wall"] += _event["wall"]
+            _phase["cpu"] += _event["cpu"]
+            _phase["blocks"] += _event["blocks"]
+            for _key,_value in _event["args"].items():
+                if isinstance(_value,(int,float)):
+                    _phase[_key] = _phase.get(_key,0) + _value
+        for _phase in _phases.values():
+            _phase["wall"] = round(_phase["wall"],6)
+            _phase["cpu"] = round(_phase["cpu"],6)
+        return list(_phases.values())
+
+    def trace(self,**metadata):
+        _threads = {}
+        _events = []
+        for _event in sorted(self.events,key=lambda x: x["start"]):
+            _tid = _threads.setdefault(_event["thread"],len(_threads) + 1)
+            _events.append({
+                "name"  : f"{_event['name']} {_event['host'] or 'local'}" if _event["host"] is not None else _event["name"],
+                "cat"   : _event["name"],
+                "ph"    : "X",
+                "ts"    : round(_event["start"] * 1e6),
+                "dur"   : round(_event["wall"] * 1e6),
+                "pid"   : os.getpid(),
+                "tid"   : _tid,
+                "args"  : dict(_event["args"],cpu=round(_event["cpu"],6),blocks=_event["blocks"])
+            })
+        return {
+            "traceEvents"       : _events,
+            "displayTimeUnit"   : "ms",
+            "phases"            : self.summary(),
+            "hooks"             : self.hooks,
+            "metadata"          : dict(metadata,version=VERSION,cpu=round(time.process_time(),6),wall=round(time.perf_counter() - self._start,6))
+        }
+
 class zfscheck(object):
-    ZFSLIST_REGEX = re.compile(r"^(?P<dataset>.*?)(?:|@(?P<snapshot>.*?))\t(?P<type>\w*)\t(?P<creation>\d+)\t(?P<guid>\d+)\t(?P<used>\d+|-)\t(?P<available>\d+|-)\t(?P<written>\d+|-)\t(?P<origin>.*?)\t(?P<autosnapshot>[-\w]+)\t(?P<checkzfs>[-\w]+)$",re.M)
+    ZFSLIST_FIELDS = 10 ## name,type,creation,guid,used,available,written,origin,autosnapshot,checkzfs
+    LEGACY_PROPERTIES = ("type","creation","guid","used","available","written","origin","com.sun:auto-snapshot") ## zfs get für legacyhosts, + ignoreattr
     ZFS_DATASETS = {}
-    ZFS_SNAPSHOTS = {}
+    ZFS_SNAPSHOTS = {} ## guid -> source snapshot, bei mehreren sources oder replikaten ohne source (snapshots,), verknüpfte replikate in snapshot.replica (und im index wenn danach noch source hosts kamen)
     #VALIDCOLUMNS = ["source","replica","type","autosnap","snapshot","creation","guid","used","referenced","size","age","status","message"] ## valid columns
-    VALIDCOLUMNS = zfs_dataset("","",0,0,0,"","","").get_info(None).keys() ## generate with dummy values
+    VALIDCOLUMNS = ["source","replica","type","autosnapshot","used","available","creation","count","snapshot","age","written","origin","guid","pending","throughput","eta","status","message"] ## schlüssel von status_evaluator.evaluate, statisch damit beim start nichts berechnet wird
     DEFAULT_COLUMNS = ["status","source","replica","snapshot","age","count"] #,"message"] ## default columns
     DATEFORMAT = "%a %d.%b.%Y %H:%M"
     COLOR_CONSOLE = {
@@ -254,13 +524,35 @@ class zfscheck(object):
         "written"       : _("geschrieben"),
         "origin"        : _("Ursprung"),
         "autosnapshot"  : _("Autosnapshot"),
-        "message"       : _("Kommentar")
+        "message"       : _("Kommentar"),
+        "pending"       : _("ausstehend"),
+        "throughput"    : _("Durchsatz"),
+        "eta"           : _("aufgeholt in"),
+        "samples"       : _("Werte"),
+        "first"         : _("von"),
+        "last"          : _("bis"),
+        "age_min"       : _("Alter min"),
+        "age_max"       : _("Alter max"),
+        "label"         : _("Label"),
+        "hop"           : _("Hop"),
+        "upstream"      : _("empfängt von"),
+        "lag"           : _("Verzögerung"),
+        "common"        : _("letzter gemeinsamer"),
+        "missing"       : _("fehlend"),
+        "first_missing" : _("erster fehlender"),
+        "gaps"          : _("Lücken"),
+        "blocking"      : _("nur Replikat")
     }
     COLUMN_ALIGN = {  ## formatierung align - python string format
         "source"    : "<",
         "replica"   : "<",
         "snapshot"  : "<",
         "copy"      : "<",
+        "common"    : "<",
+        "first_missing" : "<",
+        "gaps"      : "<",
+        "blocking"  : "<",
+        "upstream"  : "<",
         "status"    : "^"
     }
 
@@ -271,12 +563,38 @@ class zfscheck(object):
         "m" : 60 * 24 * 30 ## Monat
     }
     COLUMN_MAPPER = {}
+    FETCH_WORKERS = 16 ## max. gleichzeitige ssh/zfs aufrufe
+    HOST_TIMEOUT = 60 ## sekunden pro host wenn nicht per --timeout gesetzt
+    SSH_PERSIST = 300 ## sekunden die eine ssh master verbindung offen bleibt
+    DEFAULT_CACHEDIR = "/var/lib/checkzfs"
+    DAEMON_INTERVAL = 60 ## sekunden zwischen den abfragen im daemon modus
+    SHARED_ROWS = None ## --batch: (host,ignoreattr,ssh/legacy/agent einstellungen) -> zeilen, gemeinsam für alle configs
+    SELFCHECK_THRESHOLD = (30,50) ## laufzeit warn,crit in sekunden, check_mk agent timeout ist standardmäßig 60
+    INVENTORY_CHUNK = 100 ## datasets pro zfs list aufruf bei --cachedir
+    INVENTORY_RECHECK = 86400 ## host ohne snapshots_changed erst nach einem tag wieder prüfen
+    RATE_WINDOW = 21600 ## sekunden, durchsatz als zeitgewichteter gleitender durchschnitt (replikation läuft oft nur stündlich)
+    RATE_EXPIRE = 604800 ## paare die eine woche nicht mehr gesehen wurden aus dem state entfernen
+    HISTORY_DAYS = 30 ## --keep-history ohne wert
+    HISTORY_RAW = 172800 ## sekunden mit einzelnen werten, ältere werden zu stundenwerten zusammengefasst
+    HISTORY_RESOLUTION = 3600
+    HISTORY_COLUMNS = ["status","source","replica","samples","first","last","age_min","age","age_max","count","used","pending"] ## --history, werte ausser min/max sind durchschnitte
+    GAP_COLUMNS = ["status","source","replica","common","missing","first_missing","gaps","blocking","message"] ## --output gaps
+    GAP_LIST_MAX = 5 ## lücken/snapshots pro zelle, der rest nur als anzahl
+    LABELS = ("frequent","hourly","daily","weekly","monthly","yearly","backup-zfs","bashclub-zfs") ## wie check-snapshot-age
+    RETENTION_COLUMNS = ["status","source","replica","label","count","first","last","snapshot","age","message"] ## --output retention
+    TOPOLOGY_COLUMNS = ["status","source","hop","upstream","replica","snapshot","lag","age","message"] ## --output topology
+    STREAM_CHUNK = 1000 ## datasets pro auswertung bei --stream
+    STREAM_SAMPLE = 1000 ## zeilen aus denen --stream table die spaltenbreite ermittelt, 0 = feste breiten
+    STREAM_WIDTHS = {"status":7,"source":40,"replica":40,"type":10,"autosnapshot":18,"used":11,"available":11,"creation":22,"count":5,"snapshot":35,"age":12,"written":11,"origin":20,"guid":20,"message":40}
 
     def __init__(self,remote,source,sourceonly,legacyhosts,output,ignoreattr,mail=None,prefix='REPLICA',debug=False,**kwargs):
+        import hashlib
         _start_time = time.time()
         self.remote_hosts = remote.split(",") if remote else [""] if source and not sourceonly else [] ## wenn nicht und source woanders ... "" (also lokal) als remote
         self.source_hosts = source.split(",") if source else [""] ## wenn nix dann "" als local
         self.legacy_hosts = legacyhosts.split(",") if legacyhosts else []
+        self.agent_hosts = []
+        self.compress = False
         self.sourceonly = sourceonly
         self.filter = None
         self.debug = debug
@@ -286,6 +604,32 @@ class zfscheck(object):
         self.ignoreattr = ignoreattr
         self.mail_address = mail
         self._overall_status = []
+        self.host_errors = {}
+        self.timeout = self.HOST_TIMEOUT
+        self.ssh_persist = self.SSH_PERSIST
+        self._ssh_reused = {}
+        self.cachedir = None
+        self.cached = 0
+        self.cached_refresh = False
+        self.daemon = None
+        self.interval = self.DAEMON_INTERVAL
+        self.columns = None
+        self._columns_default = False
+        self.stream = None
+        self.stream_sample = self.STREAM_SAMPLE
+        self.profile = None
+        self.profile_hook = None
+        self.selfcheck = None
+        self.keep_history = None
+        self.retention = None
+        self.history = None
+        self.zabbix_sender = None
+        self._stats = {}
+        self._host_stats = {}
+        self._rates = {}
+        self._rate_state = None
+        self._data_lock = threading.Lock()
+        self._config_key = hashlib.sha1(repr(sorted(dict(kwargs,remote=remote,source=source,sourceonly=sourceonly,legacyhosts=legacyhosts,output=output,ignoreattr=ignoreattr,prefix=prefix,cached_refresh=None).items())).encode("utf-8")).hexdigest()[:16]
         self.sortreverse = False
         self.output = output if mail == None else "mail"
         self.print_debug(f"set attribute: remote -> {self.remote_hosts!r}")
@@ -295,24 +639,86 @@ class zfscheck(object):
         if legacyhosts:
             self.print_debug(f"set attribute: legacyhosts -> {self.legacy_hosts}")
         self._check_kwargs(kwargs)
+        self.profiler = phase_profiler(enabled=bool(self.profile),hook=self.profile_hook)
         self.print_debug(f"set attribute: output -> {self.output!r}")
+        if self.ssh_persist <= 0:
+            self.ssh_cleanup() ## keine wiederverwendung gewünscht, evtl. noch offene master beenden
+        if self.history:
+            print(self.history_output(self.history_query(self.history)))
+            return
+        if self.output == "checkmk" and self.cached > 0:
+            _output = self.checkmk_cached_output()
+            if _output is not None:
+                print(_output)
+            return
+        if self.daemon:
+            self.serve_daemon()
+            return
         self.get_data()
-        if self.output != "snaplist":
-            _data = self.get_output()
-        else:
-            print(self.get_snaplist())
-        if self.output == "text" or self.output == "":
-            print(self.table_output(_data))
-        if self.output == "html":
-            print( self.html_output(_data))
+        self.record_history()
         if self.output == "mail":
-            self.mail_output(_data)
-        if self.output == "checkmk":
-            print(self.checkmk_output(_data))
-        if self.output == "json":
-            print(self.json_output(_data))
-        if self.output == "csv":
-            print(self.csv_output(_data))
+            self.mail_output(self.get_output())
+        elif self.stream and self.output in ("","text","csv","json","snaplist","gaps","topology","retention"):
+            self.stream_output(self.stream,sys.stdout)
+        elif self.output in self.RENDER_OUTPUTS:
+            print(self.render(self.output))
+        if self.profile:
+            self.write_profile(self.profile)
+
+    def write_profile(self,filename): ## --profile, "-" nach stderr
+        import json
+        _trace = json.dumps(self.profiler.trace(**dict(self._stats,output=self.output,hostnames=list(dict.fromkeys(self.source_hosts + self.remote_hosts)))),indent=1)
+        if filename == "-":
+            sys.stderr.write(_trace + "\n")
+            return
+        with open(filename,"wt") as _f:
+            _f.write(_trace)
+
+    RENDER_OUTPUTS = ("","text","html","checkmk","json","csv","snaplist","gaps","topology","retention","zabbix")
+    def render(self,output): ## ausgabe aus den aktuellen daten erzeugen
+        with self._data_lock:
+            self._overall_status = []
+            if self._columns_default:
+                self.columns = self._default_columns(output)
+            if output == "snaplist":
+                with self.profiler.phase("render",output=output):
+                    return self.get_snaplist()
+            if output == "gaps":
+                with self.profiler.phase("render",output=output):
+                    return self.get_gaps()
+            if output == "topology":
+                with self.profiler.phase("render",output=output):
+                    return self.get_topology()
+            if output == "retention":
+                with self.profiler.phase("render",output=output):
+                    return self.get_retention()
+            with self.profiler.phase("evaluate") as _phase:
+                _data = self.get_output()
+                _phase["args"]["rows"] = len(_data)
+            with self.profiler.phase("render",output=output):
+                if output == "text" or output == "":
+                    return self.table_output(_data)
+                if output == "html":
+                    return self.html_output(_data)
+                if output == "checkmk":
+                    return self.checkmk_output(_data)
+                if output == "json":
+                    return self.json_output(_data)
+                if output == "csv":
+                    return self.csv_output(_data)
+                if output == "zabbix":
+                    return self.zabbix_output(_data)
+
+    def _default_columns(self,output):
+        if output == "snaplist":
+            return ["status","source","snapshot","replica","guid","age"]
+        if output == "gaps":
+            return self.GAP_COLUMNS[:]
+        if output == "topology":
+            return self.TOPOLOGY_COLUMNS[:]
+        if output == "retention":
+            return self.RETENTION_COLUMNS[:]
+        return self.DEFAULT_COLUMNS[:]
 
     def _check_kwargs(self,kwargs): ## alle argumente prüfen und als attribute zuordnen
         ## argumente überprüfen
@@ -321,13 +727,11 @@ class zfscheck(object):
             self.print_debug(f"set attribute: {_k} -> {_v!r}")
 
             if _k == "columns":
-                if self.output == "snaplist":
-                    _default = ["status","source","snapshot","replica","guid","age"]
-                else:
-                    _default = self.DEFAULT_COLUMNS[:]
+                _default = self._default_columns(self.output)
 
                 if not _v:
                     self.columns = _default
+                    self._columns_default = True
                     continue ## defaults
                 # add modus wenn mit +
                 if not _v.startswith("+"):
@@ -336,12 +740,13 @@ class zfscheck(object):
                     _v = _v[1:]
                 _v = _v.split(",")
 
+                _valid = {"gaps":self.GAP_COLUMNS,"topology":self.TOPOLOGY_COLUMNS,"retention":self.RETENTION_COLUMNS}.get(self.output,self.VALIDCOLUMNS)
                 if _v == ["*"]:
-                    _default = self.VALIDCOLUMNS
+                    _default = _valid
                 else:
                     for _column in _v:
-                        if _column not in self.VALIDCOLUMNS:
-                            raise Exception(_("ungültiger Spaltenname {0} ({1})").format(_v,",".join(self.VALIDCOLUMNS)))
+                        if _column not in _valid:
+                            raise Exception(_("ungültiger Spaltenname {0} ({1})").format(_v,",".join(_valid)))
                         _default.append(_column)
                 _v = list(_default)
 
@@ -369,6 +774,50 @@ class zfscheck(object):
                     _v = (float("inf"),_v[0])
                 _v = sorted(_v)  ## kleinere Wert ist immer warn
 
+            if _k == "timeout":
+                _v = float(_v) if _v else self.HOST_TIMEOUT
+
+            if _k == "agenthosts":
+                self.agent_hosts = _v.split(",") if _v else []
+
+            if _k == "compress":
+                _v = bool(_v) and str(_v).lower() not in ("0","no","false")
+
+            if _k == "selfcheck" and _v is not None:
+                _v = list(map(float,_v.split(","))) if _v else list(self.SELFCHECK_THRESHOLD)
+                if len(_v) == 1: ## wie threshold, ein wert ist nur warn
+                    _v = [float("inf"),_v[0]]
+                _v = sorted(_v[:2])
+
+            if _k == "interval":
+                _v = int(_v) if _v else self.DAEMON_INTERVAL
+
+            if _k == "cached":
+                _v = int(_v) if _v else 0
+
+            if _k == "retention" and _v:
+                _retention = {} ## label -> (mindestanzahl, max alter des neuesten in sekunden)
+                for _item in _v.split(","):
+                    _label, _limits = _item.partition("=")[::2]
+                    _label = _label.strip()
+                    if _label not in self.LABELS + ("other",):
+                        raise Exception(_("ungültiges Label {0} ({1})").format(_label,",".join(self.LABELS + ("other",))))
+                    _count, _maxage = _limits.partition(":")[::2]
+                    _retention[_label] = (int(_count) if _count.strip() else None,self.parse_minutes(_maxage) * 60 if _maxage.strip() else None)
+                _v = _retention
+
+            if _k == "keep_history" and _v is not None:
+                _v = int(_v) if _v else self.HISTORY_DAYS
+
+            if _k == "history" and _v:
+                _v = self.parse_minutes(_v) * 60 ## zeitfenster in sekunden
+
+            if _k == "stream_sample":
+                _v = int(_v) if _v not in (None,"") else self.STREAM_SAMPLE
+
+            if _k == "ssh_persist":
+                _v = int(_v) if _v not in (None,"") else self.SSH_PERSIST
+
             if _k in ("filter","snapshotfilter","replicafilter"):
                 if _v:
                     if _v.startswith("!"):
@@ -389,74 +838,209 @@ class zfscheck(object):
                 "available"     : self.format_bytes,
                 "written"       : self.format_bytes,
                 "autosnapshot"  : self.format_autosnapshot,
-                "status"        : self.format_status
+                "status"        : self.format_status,
+                "pending"       : self.format_bytes,
+                "throughput"    : lambda x: self.format_bytes(x,"B/s") if x != "" else "",
+                "eta"           : lambda x: (self.seconds2timespan(x) or "0") if x != "" else "",
+                "age_min"       : self.seconds2timespan,
+                "age_max"       : self.seconds2timespan,
+                "lag"           : self.seconds2timespan,
+                "first"         : lambda x: self.convert_ts_date(x) if x else "",
+                "last"          : lambda x: self.convert_ts_date(x) if x else ""
             }
 
     def get_data(self):
-        _hosts_checked = []
-        _remote_servers = set(self.source_hosts + self.remote_hosts) ### no duplicate connection
-        _remote_data = {}
+        from concurrent.futures import ThreadPoolExecutor
+        _remote_servers = list(dict.fromkeys(self.source_hosts + self.remote_hosts)) ### no duplicate connection / reihenfolge bleibt
+        _remote_servers = [_remote.strip() if type(_remote) == str else None for _remote in _remote_servers] ## keine leerzeichen, werden von ghbn mit aufgelöst
         _start_time = time.time()
-        _iteration = 0
-        for _remote in _remote_servers: ## erstmal rohdaten holen
-            _remote = _remote.strip() if type(_remote) == str else None ## keine leerzeichen, werden von ghbn mit aufgelöst 
-            _remote_data[_remote] = self._call_proc(_remote)
-            _iteration+=1
-
-        _matched_snapshots = 0
-        _filtered_snapshots = 0
-        for _remote,_rawdata in _remote_data.items(): ## allen source datasets erstmal snapshots hinzu und bei den anderen dataset anlegen
-            for _entry in self._parse(_rawdata):
-                _iteration+=1
-                _dsname = "{0}#{dataset}".format(_remote,**_entry)  ## name bilden
-                _is_source = bool(_remote in self.source_hosts and self.filter.search(_dsname))
-                if _entry.get("type") in ("volume","filesystem"): ## erstmal keine snapshots
-                    self.ZFS_DATASETS[_dsname] = zfs_dataset(**_entry,remote=_remote,source=_is_source)
-                    continue ## nix mehr zu tun ohne snapshot
-                if not _is_source:
+        _zfs_datasets = {} ## neu aufbauen und erst am ende austauschen (daemon liefert solange die alten daten)
+        _zfs_snapshots = {}
+        _host_errors = {}
+        self._stats = {"rows":0,"matched":0,"filtered":0}
+        self._host_stats = {_remote:{"seconds":0.0,"bytes":0,"lines":0,"rows":0,"matched":0,"filtered":0} for _remote in _remote_servers} ## zähler aus _call_proc / _fetch_datasets für checkzfs_self
+        with self.profiler.phase("get_data"), ThreadPoolExecutor(max_workers=max(1,min(self.FETCH_WORKERS,len(_remote_servers)))) as _pool: ## alle hosts gleichzeitig abfragen und parsen
+            _jobs = [(_remote,_pool.submit(self._fetch_host,_remote)) for _remote in _remote_servers]
+            for _index,(_remote,_job) in enumerate(_jobs): ## in fester reihenfolge übernehmen, während die anderen noch laufen
+                try:
+                    _datasets = _job.result()
+                except Exception as e: ## host fehlerhaft ... als eigenes ergebnis, die anderen hosts trotzdem auswerten
+                    _host_errors[_remote] = str(e).strip()
+                    self.print_debug(f"host {_remote!r} failed: {_host_errors[_remote]}")
                     continue
-                ## snapshots
-                if not self.snapshotfilter.search(_entry.get("snapshot","")): ## wenn --snapshotfilter gesetzt und kein match
-                    _filtered_snapshots+=1
-                    continue 
-                _matched_snapshots+=1
-                _dataset = self.ZFS_DATASETS.get("{0}#{dataset}".format(_remote,**_entry))
+                self._register(_datasets,_zfs_datasets,_zfs_snapshots,_remote,keep_linked=any(_later in self.source_hosts for _later in _remote_servers[_index + 1:]))
+        for _key in ("rows","matched","filtered"):
+            self._stats[_key] = sum(_stats[_key] for _stats in self._host_stats.values())
+        _rates = self._update_rates(_zfs_datasets,_start_time) if self.cachedir or self.daemon else {}
+        with self._data_lock:
+            self.ZFS_DATASETS, self.ZFS_SNAPSHOTS, self.host_errors, self._rates = _zfs_datasets, _zfs_snapshots, _host_errors, _rates
+        _execution_time = time.time() - _start_time
+        self._stats.update(runtime=_execution_time,hosts=len(_remote_servers),failed=len(_host_errors),datasets=len(_zfs_datasets),snapshots=sum(len(_dataset.snapshots) for _dataset in _zfs_datasets.values()))
+        if self.debug:
+            _unlinked = sum(len(_snapshots) for _snapshots in ((_snapshots if type(_snapshots) is tuple else (_snapshots,)) for _snapshots in _zfs_snapshots.values()) if not any(_snapshot.dataset_obj.is_source for _snapshot in _snapshots))
+            self.print_debug(f"computation time: {_execution_time:0.2f} sec / rows: {self._stats['rows']} / matched snapshots: {self._stats['matched']} / filtered snaphots: {self._stats['filtered']} / unlinked replica snapshots: {_unlinked}")
+
+    def _update_rates(self,zfs_datasets,now): ## replizierter durchsatz pro source/replika paar seit dem letzten lauf, state im cachedir bzw. im daemon speicher
+        import hashlib
+        import json
+        import math
+        _statefile = os.path.join(self.cachedir,"replication-{0}.json".format(
+            hashlib.sha1(f"{self.source_hosts}:{self.remote_hosts}:{self.ignoreattr}".encode("utf-8")).hexdigest()[:16])) if self.cachedir else None
+        if self._rate_state is None:
+            self._rate_state = {}
+            if _statefile:
                 try:
-                    _snapshot = _dataset.add_snapshot(**_entry)
-                except:
+                    with open(_statefile,"rt") as _f:
+                        self._rate_state = json.load(_f)
+                except (OSError,ValueError):
                     pass
-                    raise
-                self.ZFS_SNAPSHOTS[_snapshot.guid] = _snapshot
-        _execution_time = time.time() - _start_time
-
+        _state = self._rate_state ## "source>replica" -> [zeit, guid letzter gemeinsamer, bytes/s oder None]
+        _rates = {}
+        for _dataset in zfs_datasets.values():
+            if not _dataset.is_source:
+                continue
+            for _replica in _dataset.replica:
+                _common = _replica._get_latest_snapshot(_dataset)
+                if _common is None:
+                    continue
+                _key = f"{_dataset.dataset_name}>{_replica.dataset_name}"
+                _time, _guid, _rate = _state.get(_key) or (now,None,None)
+                _previous = _dataset.snapshots.get(_guid)
+                if now > _time and _previous is not None: ## bytes zwischen dem alten und neuen gemeinsamen snapshot wurden seitdem übertragen
+                    _observed = max(0,_dataset.written_since(_previous) - _dataset.written_since(_common)) / (now - _time)
+                    _weight = 1 - math.exp(-(now - _time) / self.RATE_WINDOW)
+                    _rate = _observed if _rate is None else _rate + _weight * (_observed - _rate)
+                    _time = now
+                elif _previous is None: ## erster lauf oder alter gemeinsamer snapshot schon gelöscht, neu beginnen
+                    _time = now
+                _state[_key] = [_time,_common.guid,_rate]
+                if _rate is not None:
+                    _rates[(_dataset.dataset_name,_replica.dataset_name)] = int(round(_rate))
+        for _key in [_key for _key,(_time,_guid,_rate) in _state.items() if now - _time > self.RATE_EXPIRE]:
+            del _state[_key]
+        if _statefile:
+            self._write_cache(_statefile,_state)
+        return _rates
+
+    def _fetch_host(self,remote): ## läuft im thread, baut nur host-lokale objekte in einem durchgang
+        with self.profiler.phase("fetch",remote) as _phase:
+            _datasets = self._fetch_datasets(remote)
+            _phase["args"].update(datasets=len(_datasets),snapshots=sum(len(_dataset.snapshots) for _dataset in _datasets.values()))
+        return _datasets
+
+    def _fetch_datasets(self,remote):
+        _datasets = {}
+        _dataset = None
+        _is_source_host = remote in self.source_hosts
+        _rows = _matched = _filtered = 0
+        _host_rows = self._host_rows(remote)
+        if self.profile:
+            _host_rows = self.profiler.timed(_host_rows,"read_sec") ## anteil warten auf zfs/ssh und parsen
+        for _name,_type,_creation,_guid,_used,_available,_written,_origin,_autosnapshot,_checkzfs in _host_rows:
+            _rows+=1
+            _dsname, _, _snapname = _name.partition("@")
+            if _type != "snapshot": ## volume / filesystem
+                _fullname = f"{remote}#{_dsname}" ## name bilden
+                _is_source = bool(_is_source_host and self.filter.search(_fullname))
+                _dataset = _datasets[_fullname] = zfs_dataset(_dsname,_guid,_used,_available,_creation,_type,_autosnapshot,_checkzfs,remote=remote,source=_is_source)
+                continue
+            if _dataset is None or _dataset.dataset != _dsname: ## snapshots kommen normalerweise direkt nach ihrem dataset
+                _dataset = _datasets.get(f"{remote}#{_dsname}")
+                if _dataset is None:
+                    continue
+            if _dataset.is_source:
+                if not self.snapshotfilter.search(_snapname): ## wenn --snapshotfilter gesetzt und kein match
+                    _filtered+=1
+                    continue
+                _matched+=1
+            elif self.sourceonly == True:
+                continue
+            _dataset.add_snapshot(snapshot=_snapname,creation=_creation,guid=_guid,written=_written,origin=_origin)
+        if remote in self._host_stats: ## jeder worker nur in seinen host eintrag, summe in get_data nach dem pool
+            self._host_stats[remote].update(rows=_rows,matched=_matched,filtered=_filtered)
+        self.profiler.count(rows=_rows,matched=_matched,filtered=_filtered)
+        return _datasets
+
+    def _host_rows(self,remote): ## zeilen von zfs list als felder, bei --batch für alle configs nur einmal abgefragt
+        if self.SHARED_ROWS is None:
+            return self._query_rows(remote)
+        _agent = bool(remote) and remote in self.agent_hosts
+        _ssh = (self.ssh_identity,self.ssh_extra_options) if remote else None ## lokal ohne ssh
+        _key = (remote,self.ignoreattr,_ssh,remote in self.legacy_hosts,_agent,_agent and self.compress) ## configs mit anderem abfrageweg holen selbst
+        if _key not in self.SHARED_ROWS:
+            try:
+                _rows = list(self._query_rows(remote))
+                self.SHARED_ROWS[_key] = (_rows,dict(self._host_stats.get(remote,{}))) ## abfrage zähler für checkzfs_self der anderen configs
+            except Exception as e: ## fehler auch nur einmal
+                self.SHARED_ROWS[_key] = e
+        if isinstance(self.SHARED_ROWS[_key],Exception):
+            raise self.SHARED_ROWS[_key]
+        _rows, _stats = self.SHARED_ROWS[_key]
+        if remote in self._host_stats:
+            self._host_stats[remote].update((_k,_v) for _k,_v in _stats.items() if _k in ("seconds","bytes","lines"))
+        self.print_debug(f"{remote or 'local'}: {len(_rows)} shared rows")
+        return iter(_rows)
+
+    def _query_rows(self,remote): ## zeilen von zfs list als felder, je nach host auf unterschiedlichem weg
+        if remote in self.legacy_hosts:
+            return self._legacy_rows(remote)
+        if remote and remote in self.agent_hosts:
+            return self._agent_rows(remote)
+        if self.cachedir:
+            return self._parse(self._incremental_list(remote))
+        return self._parse(self._call_proc(remote))
+
+    def _register(self,datasets,zfs_datasets,zfs_snapshots,remote=None,keep_linked=True): ## datasets eines hosts übernehmen, source guids indizieren und replikate verknüpfen
+        ## keep_linked: verknüpfte replikate auch im index behalten, nötig solange noch source hosts folgen
+        with self.profiler.phase("index",remote) as _phase:
+            for _dsname,_dataset in datasets.items():
+                zfs_datasets[_dsname] = _dataset
+                if not _dataset.is_source:
+                    continue
+                _phase["args"]["snapshots"] = _phase["args"].get("snapshots",0) + len(_dataset.snapshots)
+                for _snapshot in _dataset.snapshots.values():
+                    _known = zfs_snapshots.get(_snapshot.guid) ## gleiche guid auf allen hosts
+                    if _known is None: ## meist nur einer, dann ohne tuple
+                        zfs_snapshots[_snapshot.guid] = _snapshot
+                        continue
+                    _known = _known if type(_known) is tuple else (_known,)
+                    zfs_snapshots[_snapshot.guid] = _known + (_snapshot,)
+                    for _replica in _known:
+                        if not _replica.dataset_obj.is_source: ## replikat war schon vor der source da
+                            _snapshot.add_replica(_replica)
         if self.sourceonly == True:
             return
-
-        for _remote,_rawdata in _remote_data.items(): ## jetzt nach replica suchen
-            for _entry in self._parse(_rawdata):  ## regex geparste ausgabe von zfs list 
-                _iteration+=1
-                if _entry.get("type") != "snapshot": ## jetzt nur die snapshots
+        with self.profiler.phase("link",remote) as _phase: ## erst nach den sources des gleichen hosts, ergibt die gleiche reihenfolge
+            for _dataset in datasets.values():
+                if _dataset.is_source or not self.replicafilter.search(_dataset.dataset_name):
                     continue
-                _dataset = self.ZFS_DATASETS.get("{0}#{dataset}".format(_remote,**_entry))
-                if _dataset.is_source:
-                    continue ## ist schon source
-                _snapshot = _dataset.add_snapshot(**_entry) ## snapshot dem dataset hinzufügen .. eigentliche verarbeitung Klasse oben snapshot object wird zurück gegeben
-                _source_snapshot = self.ZFS_SNAPSHOTS.get(_snapshot.guid) ## suchen ob es einen source gibt
-                if _source_snapshot: ## wenn es schon eine gleiche guid gibt
-                    if self.replicafilter.search(_dataset.dataset_name):
-                        _source_snapshot.add_replica(_snapshot) ## replica hinzu
-
-        self.print_debug(f"computation time: {_execution_time:0.2f} sec /  iterations: {_iteration} / matched snapshots: {_matched_snapshots} / filtered snaphots: {_filtered_snapshots}")
-
+                _phase["args"]["snapshots"] = _phase["args"].get("snapshots",0) + len(_dataset.snapshots)
+                for _snapshot in _dataset.snapshots.values():
+                    _known = zfs_snapshots.get(_snapshot.guid) ## alle snapshots mit dieser guid, auch von mehreren source hosts
+                    if _known is None: ## (noch) keine source, merken für spätere hosts
+                        zfs_snapshots[_snapshot.guid] = _snapshot
+                        continue
+                    _known = _known if type(_known) is tuple else (_known,)
+                    _linked = False
+                    for _source_snapshot in _known:
+                        if _source_snapshot.dataset_obj.is_source:
+                            _source_snapshot.add_replica(_snapshot) ## replica hinzu, über _source_snapshot.replica erreichbar
+                            _linked = True
+                    if keep_linked or not _linked: ## eine source auf einem späteren host muss das replikat noch finden
+                        zfs_snapshots[_snapshot.guid] = _known + (_snapshot,)
 
     def get_snaplist(self):
-        _output = []
+        return self.table_output(list(self.iter_snaplist()))
+
+    def iter_snaplist(self): ## zeilen für --snaplist einzeln erzeugen, --stream gibt sie direkt aus
+        for _remote,_message in self.host_errors.items():
+            yield {"status":3,"source":_remote or "localhost","snapshot":"","replica":"","guid":"","age":0,"written":0}
         for _dataset in self.ZFS_DATASETS.values():
             if not _dataset.is_source: ## nur source im filter
                 continue
             for _snapshot in _dataset.snapshots.values():
                 _replicas = list(map(lambda x: x.dataset_obj.dataset_name,_snapshot.replica))
-                _output.append({
+                yield {
                     "status"        : 1 if len(_replicas) == 0 else 0,
                     "source"        : _dataset.dataset_name,
                     "snapshot"      : _snapshot.snapshot,
@@ -464,74 +1048,366 @@ class zfscheck(object):
                     "guid"          : _snapshot.guid,
                     "age"           : _snapshot.age,
                     "written"       : _snapshot.written,
-                })
-                
-                #print(f"{_snapshot.snapshot}{_snapshot.guid}{_snapshot.replica}")
-        return self.table_output(_output)
+                }
+
+    def get_gaps(self):
+        return self.table_output(list(self.iter_gaps()))
+
+    def iter_gaps(self): ## --output gaps, je source/replika paar die lücken des replikats
+        for _remote,_message in self.host_errors.items():
+            yield dict(dict.fromkeys(self.GAP_COLUMNS,""),status=3,source=_remote or "localhost",missing=0,message=_("Abfrage fehlgeschlagen: {0}").format(" ".join(_message.split())))
+        for _dataset in self.ZFS_DATASETS.values():
+            if not _dataset.is_source:
+                continue
+            for _replica in sorted(_dataset.replica,key=lambda x: x.dataset_name):
+                yield self._replica_gaps(_dataset,_replica)
+
+    def _replica_gaps(self,source,replica): ## ein durchgang über die snapshots beider seiten, lookup über die guid dicts
+        _common = replica._get_latest_snapshot(source)
+        _holes = [] ## [erster,letzter,anzahl] fehlender snapshots vor dem letzten gemeinsamen
+        _missing = [] ## source snapshots nach dem letzten gemeinsamen
+        _run = None
+        for _snapshot in source.ordered_snapshots():
+            if _common is None or _snapshot.creation > _common.creation:
+                _missing.append(_snapshot)
+            elif _snapshot.guid in replica.snapshots:
+                _run = None
+            elif _run:
+                _run[1] = _snapshot
+                _run[2] += 1
+            else:
+                _run = [_snapshot,_snapshot,1]
+                _holes.append(_run)
+        _blocking = [ ## nur auf dem replikat und neuer als der letzte gemeinsame, zfs recv ginge nur mit -F
+            _snapshot for _snapshot in replica.ordered_snapshots()
+            if _snapshot.guid not in source.snapshots and self.snapshotfilter.search(_snapshot.snapshot) and (_common is None or _snapshot.creation > _common.creation)
+        ]
+        _status = 0
+        _message = ""
+        if _missing:
+            _message = _("{0} Snapshots noch nicht repliziert").format(len(_missing))
+        if _common is None:
+            _status = 2
+            _message = _("kein gemeinsamer Snapshot, nur vollständiges Senden möglich")
+        elif _blocking:
+            _status = 2
+            _message = _("{0} Snapshots nur auf dem Replikat verhindern inkrementelles Senden").format(len(_blocking))
+        if not replica.checkzfs:
+            _status = -1
+        return {
+            "status"        : _status,
+            "source"        : source.dataset_name,
+            "replica"       : replica.dataset_name,
+            "common"        : _common.snapshot if _common else "",
+            "missing"       : len(_missing),
+            "first_missing" : _missing[0].snapshot if _missing else "",
+            "gaps"          : self._format_list([f"{_first.snapshot}..{_last.snapshot} ({_count})" if _count > 1 else _first.snapshot for _first,_last,_count in _holes]),
+            "blocking"      : self._format_list([_snapshot.snapshot for _snapshot in _blocking]),
+            "message"       : _message
+        }
+
+    def _format_list(self,items):
+        if len(items) > self.GAP_LIST_MAX:
+            return ",".join(items[:self.GAP_LIST_MAX]) + _(" (+{0})").format(len(items) - self.GAP_LIST_MAX)
+        return ",".join(items)
+
+    def get_retention(self):
+        return self.table_output(list(self.iter_retention()))
+
+    def iter_retention(self): ## --output retention, snapshots pro label wie check-snapshot-age aber aus den schon geholten daten
+        for _remote,_message in self.host_errors.items():
+            yield dict(dict.fromkeys(self.RETENTION_COLUMNS,""),status=3,source=_remote or "localhost",count=0,first=0,last=0,age=0,message=_("Abfrage fehlgeschlagen: {0}").format(" ".join(_message.split())))
+        _labelsearch = re.compile("|".join(self.LABELS))
+        _now = time.time()
+        for _source in self.ZFS_DATASETS.values():
+            if not _source.is_source:
+                continue
+            for _dataset in [_source] + ([] if self.sourceonly else sorted(_source.replica,key=lambda x: x.dataset_name)):
+                _buckets = self._label_buckets(_dataset,_labelsearch)
+                for _label in self.LABELS + ("other",):
+                    _bucket = _buckets.get(_label)
+                    _count, _maxage = (self.retention or {}).get(_label,(None,None))
+                    if _bucket is None and _count is None and _maxage is None:
+                        continue
+                    _number, _first, _last = _bucket or (0,None,None)
+                    _age = int(_now - _last.creation) if _last else 0
+                    _status = 0
+                    _message = ""
+                    if _count and _number < _count:
+                        _status = 1
+                        _message = _("nur {0} von {1} Snapshots").format(_number,_count)
+                    if _maxage and _age > _maxage:
+                        _status = 2
+                        _message = _("neuester Snapshot ist zu alt")
+                    if not _number and (_count or _maxage):
+                        _status = 2
+                        _message = _("keine {0} Snapshots").format(_label)
+                    yield {
+                        "status"    : _status if _dataset.checkzfs else -1,
+                        "source"    : _source.dataset_name,
+                        "replica"   : _dataset.dataset_name if _dataset is not _source else "",
+                        "label"     : _label,
+                        "count"     : _number,
+                        "first"     : _first.creation if _first else 0,
+                        "last"      : _last.creation if _last else 0,
+                        "snapshot"  : _last.snapshot if _last else "",
+                        "age"       : _age,
+                        "message"   : _message
+                    }
+
+    @staticmethod
+    def _label_buckets(dataset,labelsearch): ## ein durchgang über die nach creation sortierten snapshots, label -> [anzahl,ältester,neuester]
+        _buckets = {}
+        for _snapshot in dataset.ordered_snapshots():
+            _match = labelsearch.search(_snapshot.snapshot)
+            _label = _match.group(0) if _match else "other"
+            _bucket = _buckets.get(_label)
+            if _bucket is None:
+                _buckets[_label] = [1,_snapshot,_snapshot]
+            else:
+                _bucket[0] += 1
+                _bucket[2] = _snapshot
+        return _buckets
+
+    def _checkmk_retention(self): ## ein service pro dataset und konfiguriertem label
+        _out = []
+        for _item in self.iter_retention():
+            if _item["label"] not in self.retention or _item["status"] == -1:
+                continue
+            _count, _maxage = self.retention[_item["label"]]
+            _name = (_item["replica"] or _item["source"]).replace(" ","_")
+            _msg = _item["message"] or "OK"
+            _out.append(f"{_item['status']} {self.prefix}:{_name}@{_item['label']} count={_item['count']};;|age={_item['age']};;{_maxage or ''} - {_item['count']} {_item['label']} {_msg}")
+        return _out
+
+    def get_topology(self):
+        return self.table_output(list(self.iter_topology()))
+
+    def iter_topology(self): ## --output topology, ketten source -> replikat -> replikat des replikats mit verzögerung pro hop
+        for _remote,_message in self.host_errors.items():
+            yield dict(dict.fromkeys(self.TOPOLOGY_COLUMNS,""),status=3,source=_remote or "localhost",hop=0,lag=0,age=0,message=_("Abfrage fehlgeschlagen: {0}").format(" ".join(_message.split())))
+        _children = self._replication_graph()
+        _now = time.time()
+        _sources = [_dataset for _dataset in self.ZFS_DATASETS.values() if _dataset.is_source]
+        _evaluator = status_evaluator(threshold=self.threshold,maxsnapshots=self.maxsnapshots,ignore_replica=self.sourceonly)
+        _infos = _evaluator.evaluate([(_dataset,_dataset) for _dataset in _sources]) ## status der source wie in den anderen ausgaben
+        for _dataset,_info in zip(_sources,_infos):
+            _latest = _dataset.latest_snapshot
+            yield {
+                "status"    : _info["status"],
+                "source"    : _dataset.dataset_name,
+                "hop"       : 0,
+                "upstream"  : "",
+                "replica"   : "",
+                "snapshot"  : _latest.snapshot if _latest else "",
+                "lag"       : 0,
+                "age"       : int(_now - _latest.creation) if _latest else 0,
+                "message"   : _info["message"]
+            }
+            _stack = [(_child,_dataset,_common,1) for _child,_common in reversed(_children.get(_dataset,[]))]
+            while _stack: ## tiefensuche, jede kette direkt unter ihrer source
+                _replica,_upstream,_common,_hop = _stack.pop()
+                _lag = _upstream.latest_snapshot.creation - _common.creation ## wie weit der hop hinter seinem upstream liegt
+                _status = (2 if self.threshold[1] < _lag / 60 else 1 if self.threshold[0] < _lag / 60 else 0) if self.threshold else 0
+                yield {
+                    "status"    : _status if _replica.checkzfs else -1,
+                    "source"    : _dataset.dataset_name,
+                    "hop"       : _hop,
+                    "upstream"  : _upstream.dataset_name,
+                    "replica"   : _replica.dataset_name,
+                    "snapshot"  : _common.snapshot,
+                    "lag"       : _lag,
+                    "age"       : int(_now - _common.creation),
+                    "message"   : _("Verzögerung zu {0} zu groß").format(_upstream.dataset_name) if _status else ""
+                }
+                _stack.extend((_child,_replica,_child_common,_hop + 1) for _child,_child_common in reversed(_children.get(_replica,[])))
+
+    def _replication_graph(self): ## dataset -> [(downstream dataset, neuester gemeinsamer snapshot)] aus dem guid index aller hosts
+        _neighbors = {} ## dataset -> {dataset: neuester gemeinsamer snapshot}
+        for _snapshots in self.ZFS_SNAPSHOTS.values():
+            _snapshots = _snapshots if type(_snapshots) is tuple else (_snapshots,)
+            _snapshots = tuple(dict.fromkeys(_snapshots + tuple(_replica for _snapshot in _snapshots for _replica in _snapshot.replica))) ## alle datasets mit dieser guid, verknüpfte replikate evtl. auch im index
+            if len(_snapshots) < 2:
+                continue
+            for _index,_snapshot in enumerate(_snapshots):
+                for _other in _snapshots[_index + 1:]:
+                    if _other.dataset_obj is _snapshot.dataset_obj:
+                        continue
+                    for _dataset,_neighbor in ((_snapshot.dataset_obj,_other.dataset_obj),(_other.dataset_obj,_snapshot.dataset_obj)):
+                        _common = _neighbors.setdefault(_dataset,{}).get(_neighbor)
+                        if _common is None or _snapshot.creation > _common.creation:
+                            _neighbors[_dataset][_neighbor] = _snapshot
+        ## upstream eines replikats: source oder aktuellerer nachbar mit dem neuesten gemeinsamen snapshot,
+        ## bei gleichstand der am wenigsten aktuelle (source -> backup -> offsite statt source -> offsite)
+        _children = {}
+        for _dataset,_commons in _neighbors.items():
+            if _dataset.is_source:
+                continue
+            _candidates = [(_common.creation,-_neighbor.latest_snapshot.creation,not _neighbor.is_source,_neighbor.dataset_name,_neighbor,_common)
+                for _neighbor,_common in _commons.items() if _neighbor.is_source or _neighbor.latest_snapshot.creation > _dataset.latest_snapshot.creation]
+            if _candidates:
+                _upstream,_common = max(_candidates,key=lambda x: x[:4])[4:]
+                _children.setdefault(_upstream,[]).append((_dataset,_common))
+        for _list in _children.values():
+            _list.sort(key=lambda x: x[0].dataset_name)
+        return _children
+
+    def get_host_error_info(self,remote,message):
+        return { ## gleiche spalten wie status_evaluator.evaluate, status unknown
+            "source"        : remote or "localhost",
+            "replica"       : "",
+            "type"          : "host",
+            "autosnapshot"  : 1,
+            "used"          : 0,
+            "available"     : 0,
+            "creation"      : 0,
+            "count"         : 0,
+            "snapshot"      : "",
+            "age"           : 0,
+            "written"       : 0,
+            "origin"        : "",
+            "guid"          : "",
+            "pending"       : 0,
+            "throughput"    : "",
+            "eta"           : "",
+            "status"        : 3,
+            "message"       : _("Abfrage fehlgeschlagen: {0}").format(" ".join(message.split()))
+        }
 
     def get_output(self):
-        _output = []
+        return list(self.iter_output())
+
+    def iter_output(self,chunksize=None): ## zeilen wie get_output, mit chunksize je chunksize datasets ausgewertet und geliefert
+        for _remote,_message in self.host_errors.items(): ## hosts die nicht abgefragt werden konnten
+            _host_info = self.get_host_error_info(_remote,_message)
+            self._overall_status.append(_host_info.get("status",-1))
+            yield _host_info
+        _pairs = self._output_pairs() ## (dataset,source) in ausgabe reihenfolge, ausgewertet wird in einem durchgang
+        _evaluator = status_evaluator(threshold=self.threshold,maxsnapshots=self.maxsnapshots,ignore_replica=self.sourceonly,rates=self._rates)
+        while True:
+            _chunk = list(itertools.islice(_pairs,chunksize)) ## ohne chunksize alle auf einmal
+            if not _chunk:
+                break
+            for _info in _evaluator.evaluate(_chunk):
+                self._overall_status.append(_info.get("status",-1))  ## alle stati für email overall status
+                yield _info
+
+    def _output_pairs(self):
         for _dataset in self.ZFS_DATASETS.values(): ## alle Datasets durchgehen die als source gelistet werden sollen
             if not _dataset.is_source:  ## wenn --filter gesetzt
                 continue
-            #if _dataset.remote in self.remote_hosts:## or _dataset.autosnapshot == 0:  ## wenn das dataset von der remote seite ist ... dann weiter oder wenn autosnasphot explizit aus ist ... dann nicht als source hinzufügen
-            #    continue
-            _dataset_info = _dataset.get_info(_dataset,threshold=self.threshold,maxsnapshots=self.maxsnapshots,ignore_replica=self.sourceonly)
-            self._overall_status.append(_dataset_info.get("status",-1))  ## alle stati für email overall status
-            _output.append(_dataset_info)
+            yield (_dataset,_dataset)
             if self.sourceonly == True:
                 continue
             for _replica in _dataset.replica: ## jetzt das dataset welches als source angezeigt wird (alle filter etc entsprochen nach replika durchsuchen
-                #if not self.replicafilter.search(_replica.dataset_name):
-                #    continue
-                _replica_info = _replica.get_info(_dataset,threshold=self.threshold,maxsnapshots=self.maxsnapshots)  ## verarbeitung ausgabe aus klasse 
-                self._overall_status.append(_replica_info.get("status",-1)) ## fehler aus replica zu overall status für mail adden
-                _output.append(_replica_info)
+                yield (_replica,_dataset)
 
-        return _output
+    def _parse(self,lines): ## zfs list -Hp zeilen in felder, zeilen mit falscher spaltenanzahl ignorieren
+        _fields = self.ZFSLIST_FIELDS
+        for _line in lines:
+            _entry = _line.rstrip("\n").split("\t")
+            if len(_entry) == _fields and _entry[1] in ("filesystem","volume","snapshot"):
+                yield _entry
 
-    def _parse(self,data):
-        for _match in self.ZFSLIST_REGEX.finditer(data):
-            yield _match.groupdict()
-
-    def _call_proc(self,remote=None):
-        ZFS_ATTRIBUTES = f"name,type,creation,guid,used,available,written,origin,com.sun:auto-snapshot,{self.ignoreattr}" ## wenn ändern dann auch regex oben anpassen
-        ### eigentlicher zfs aufruf, sowohl local als auch remote
-        zfs_args = ["zfs", "list", 
-                "-t", "all",
+    @staticmethod
+    def _zfs_list_args(ignoreattr,types="all",extra_attributes="",args=()):
+        ZFS_ATTRIBUTES = f"name,type,creation,guid,used,available,written,origin,com.sun:auto-snapshot,{ignoreattr}{extra_attributes}" ## wenn ändern dann auch ZFSLIST_FIELDS / _fetch_host anpassen
+        return ["zfs", "list", 
+                "-t", types,
                 "-Hp",  ## script und numeric output
                 "-o", ZFS_ATTRIBUTES,  ## attributes to show
                 #"-r" ## recursive
-        ]
+        ] + list(args)
+
+    @staticmethod
+    def _zfs_get_args(properties,args=()):
+        return ["zfs", "get",
+                "-H", "-p", ## script und numeric output
+                "-r", "-t", "all", ## datasets und snapshots in einem aufruf
+                "-o", "name,property,value",
+                ",".join(properties)
+        ] + list(args)
+
+    def _legacy_rows(self,remote):
+        ## hosts ohne zfs list -p / written: ein rekursives zfs get für alles, die name/property/value zeilen werden zu zfs list feldern
+        _properties = self.LEGACY_PROPERTIES + (self.ignoreattr,)
+        _roots = self._zfs_roots(remote)
+        _rows = 0
+        try:
+            for _entry in self._legacy_pivot(self._call_proc(remote,self._zfs_get_args(_properties,_roots),ignore_missing=bool(_roots)),_properties):
+                _rows += 1
+                yield _entry
+        except Exception as e:
+            if _rows or "'written'" not in str(e): ## nur ein fehlendes written nochmal ohne versuchen
+                raise
+            self.print_debug(f"{remote or 'local'}: written not supported")
+            _query = tuple(_property for _property in _properties if _property != "written")
+            yield from self._legacy_pivot(self._call_proc(remote,self._zfs_get_args(_query,_roots),ignore_missing=bool(_roots)),_properties)
+
+    @staticmethod
+    def _legacy_pivot(lines,properties):
+        ## zfs get liefert alle properties eines datasets/snapshots hintereinander, properties in der reihenfolge der zfs list felder
+        _name = None
+        _values = {}
+        for _line in itertools.chain(lines,[None]): ## None am ende für den letzten eintrag
+            _entry = _line.rstrip("\n").split("\t") if _line is not None else [None]*3
+            if len(_entry) != 3:
+                continue
+            if _entry[0] != _name:
+                if _values.get("type") in ("filesystem","volume","snapshot"):
+                    yield [_name] + [_values.get(_property,"0" if _property == "written" else "-") for _property in properties] ## written fehlt bei alten zfs versionen
+                _name = _entry[0]
+                _values = {}
+            _values[_entry[1]] = _entry[2]
+
+    def _call_proc(self,remote=None,zfs_args=None,ignore_missing=False,stdin=None,binary=False):
+        ### eigentlicher zfs aufruf, sowohl local als auch remote
+        import tempfile
+        if zfs_args is None: ## komplette liste
+            _roots = self._zfs_roots(remote)
+            zfs_args = self._zfs_list_args(self.ignoreattr,args=_roots) ## wenn roots, nur die teilbäume die zum filter passen
+            ignore_missing = bool(_roots)
         if remote: ##wenn remote ssh adden
-            if remote in self.legacy_hosts:
-                zfs_args = ["zfs_legacy_list"]
-            _privkeyoption = []
-            if self.ssh_identity:
-                _privkeyoption = ["-i",self.ssh_identity]
-            _sshoptions = ["BatchMode=yes","PreferredAuthentications=publickey"]
-            __sshoptions = []
-            if self.ssh_extra_options:
-                _sshoptions += self.ssh_extra_options.split(",")
-            for _sshoption in _sshoptions:
-                __sshoptions += ["-o", _sshoption] ## alle ssh optionen brauchen -o einzeln 
-            _parts = remote.split(":")
-            _port = "22"  ## default port
-            if len(_parts) > 1:
-                remote = _parts[0]
-                _port = _parts[1]
-            zfs_args = ["ssh",
-                remote, ## Hostname
-                "-T",  ## dont allocate Terminal
-                "-p" ,  _port
-            ] + __sshoptions + _privkeyoption + zfs_args
+            zfs_args = self._ssh_args(remote) + zfs_args
         self.print_debug("call proc: '{0}'".format(" ".join(zfs_args)))
         _start_time = time.time()
-        _proc = subprocess.Popen(zfs_args,stdout=subprocess.PIPE,stderr=subprocess.PIPE,shell=False) #aufruf prog entweder lokal oder mit ssh
-        _stdout, _stderr = _proc.communicate()
+        _stderr = tempfile.TemporaryFile() ## stderr in datei, sonst kann eine volle pipe den prozess blockieren
+        _stdin = open(stdin,"rb") if stdin else subprocess.DEVNULL
+        _encoding = {} if binary else {"encoding":sys.stdout.encoding or "utf-8","errors":"replace"}
+        _proc = subprocess.Popen(zfs_args,stdin=_stdin,stdout=subprocess.PIPE,stderr=_stderr,shell=False,**_encoding) #aufruf prog entweder lokal oder mit ssh
+        if stdin:
+            _stdin.close()
+        _timed_out = threading.Event()
+        def _kill(): ## zeitlimit pro host
+            _timed_out.set()
+            _proc.kill()
+        _timer = threading.Timer(self.timeout,_kill)
+        _timer.start()
+        _lines_returned = 0
+        _bytes_returned = 0
+        try:
+            for _line in _proc.stdout if not binary else iter(lambda: _proc.stdout.read1(65536),b""): ## zeilenweise (binär in blöcken), ausgabe wird nicht komplett gepuffert
+                _lines_returned+=1
+                _bytes_returned+=len(_line)
+                yield _line
+            _proc.wait()
+        finally:
+            _timer.cancel()
+            if _proc.poll() is None: ## generator wurde abgebrochen
+                _proc.kill()
+                _proc.wait()
+            _proc.stdout.close()
         _execution_time = time.time() - _start_time
-        _lines_returned = len(_stdout.split())
-        self.print_debug(f"returncode: {_proc.returncode} / Executiontime: {_execution_time:0.2f} sec / Lines: {_lines_returned}")
+        _connection = {True:" / ssh: reused",False:" / ssh: fresh connect"}.get(self._ssh_reused.get(remote),"")
+        self.print_debug(f"{remote or 'local'}: returncode: {_proc.returncode} / Executiontime: {_execution_time:0.2f} sec{_connection} / {'Blocks' if binary else 'Lines'}: {_lines_returned} / Bytes: {_bytes_returned}")
+        self.profiler.count(bytes=_bytes_returned,lines=_lines_returned)
+        _host_stats = self._host_stats.get(remote)
+        if _host_stats is not None: ## mehrere aufrufe pro host (inkrementell) aufaddieren
+            _host_stats["seconds"] += _execution_time
+            _host_stats["bytes"] += _bytes_returned
+            _host_stats["lines"] += _lines_returned
+        if _timed_out.is_set():
+            raise Exception(_("Zeitüberschreitung nach {0:.0f} sec").format(self.timeout))
         if _proc.returncode > 0: ## wenn fehler
             if remote and _proc.returncode in (2,66,74,76): ## todo max try
                 pass ## todo retry ## hier könnte man es mehrfach versuchen wenn host nicht erreichbar aber macht bei check_mk keinen sinn
@@ -540,8 +1416,487 @@ class zfscheck(object):
             if remote and _proc.returncode in (2,65,66,67,69,70,72,73,74,76,78,79): ## manche error ignorieren hauptsächlich ssh
                 ## todo set status ssh-error ....
                 pass ## fixme ... hostkeychange evtl fehler raisen o.ä damit check_mk das mitbekommt
-            raise Exception(_stderr.decode(sys.stdout.encoding)) ## Raise Errorlevel with Error from proc -- kann check_mk stderr lesen? sollte das nach stdout?
-        return _stdout.decode(sys.stdout.encoding) ## ausgabe kommt als byte wir wollen str
+            _stderr.seek(0)
+            _errors = _stderr.read().decode(sys.stdout.encoding or "utf-8","replace")
+            if not (ignore_missing and _proc.returncode == 1 and self._only_missing_roots(_errors)): ## roots die es auf dem host nicht gibt sind kein fehler
+                raise Exception(_errors) ## Raise Errorlevel with Error from proc -- kann check_mk stderr lesen? sollte das nach stdout?
+        _stderr.close()
+
+    def _incremental_list(self,remote):
+        ## snapshots nur für datasets neu holen deren snapshots_changed sich seit dem letzten lauf geändert hat
+        import hashlib
+        import json
+        _roots = self._zfs_roots(remote)
+        _cachefile = os.path.join(self.cachedir,"inventory-{0}.json".format(
+            hashlib.sha1(f"{remote}:{self.ignoreattr}:{_roots}".encode("utf-8")).hexdigest()[:16]))
+        try:
+            with open(_cachefile,"rt") as _f:
+                _cache = json.load(_f)
+        except (OSError,ValueError):
+            _cache = {}
+        if time.time() - _cache.get("unsupported",0) < self.INVENTORY_RECHECK: ## host kennt snapshots_changed nicht
+            yield from self._call_proc(remote)
+            return
+        _cached_datasets = _cache.get("datasets",{})
+        _last_listed = _cache.get("listed",0) - 1 ## snapshots_changed hat nur sekunden, änderungen in der sekunde des letzten listings neu holen
+        _listed = time.time()
+        _datasets = {} ## name -> [snapshots_changed, datasetzeile, snapshotzeilen]
+        try:
+            for _line in self._call_proc(remote,self._zfs_list_args(self.ignoreattr,"filesystem,volume",",snapshots_changed",_roots),ignore_missing=bool(_roots)):
+                _line, _, _changed = _line.rstrip("\n").rpartition("\t")
+                _name = _line.split("\t",1)[0]
+                _cached = _cached_datasets.get(_name)
+                _snapshots = None
+                if _cached and _cached[0] == _changed:
+                    if _changed == "-": ## hatte noch nie snapshots
+                        _snapshots = []
+                    elif _changed.isdigit() and int(_changed) < _last_listed:
+                        _snapshots = _cached[1]
+                _datasets[_name] = [_changed,_line,_snapshots]
+        except Exception as e:
+            if str(e).find("snapshots_changed") == -1:
+                raise
+            self.print_debug(f"{remote or 'local'}: snapshots_changed not supported, full listing")
+            self._write_cache(_cachefile,{"unsupported":time.time()})
+            yield from self._call_proc(remote)
+            return
+        _relist = {_name:[] for _name,(_,_,_snapshots) in _datasets.items() if _snapshots is None} ## name -> neu gelistete snapshotzeilen
+        self.print_debug(f"{remote or 'local'}: incremental: {len(_datasets)} datasets / {len(_datasets) - len(_relist)} unchanged / {len(_relist)} to list")
+        _names = list(_relist)
+        if len(_relist) > len(_datasets) / 2: ## lohnt nicht, alle snapshots auf einmal
+            _calls = [_roots]
+        else:
+            _calls = [["-d","1"] + _names[_pos:_pos + self.INVENTORY_CHUNK] for _pos in range(0,len(_names),self.INVENTORY_CHUNK)]
+        for _args in _calls if _relist else []:
+            for _line in self._call_proc(remote,self._zfs_list_args(self.ignoreattr,"snapshot",args=_args),ignore_missing=True): ## dataset kann inzwischen gelöscht sein
+                _line = _line.rstrip("\n")
+                _snapshots = _relist.get(_line.split("@",1)[0]) ## beim kompletten listing auch unveränderte, die haben ihre zeilen schon aus dem cache
+                if _snapshots is not None:
+                    _snapshots.append(_line)
+        for _name,_snapshots in _relist.items():
+            _datasets[_name][2] = _snapshots
+        for _snapshots_changed,_line,_snapshots in _datasets.values():
+            yield _line
+            yield from _snapshots
+        self._write_cache(_cachefile,{"listed":_listed,"datasets":dict((_name,[_snapshots_changed,_snapshots]) for _name,(_snapshots_changed,_,_snapshots) in _datasets.items())})
+
+    def _agent_rows(self,remote):
+        ## checkzfs selbst auf dem remote host ausführen (script über stdin), kompakte liste zurück in zfs list felder
+        _roots = self._zfs_roots(remote)
+        _agent_args = ["python3","-",f"--remote-agent={','.join(_roots)}","--ignoreattr",self.ignoreattr] + (["--compress"] if self.compress else [])
+        _output = self._call_proc(remote,[shlex.quote(_arg) for _arg in _agent_args],ignore_missing=bool(_roots),stdin=os.path.realpath(__file__),binary=self.compress)
+        if self.compress:
+            yield from self._wire_decode(_output)
+            return
+        _dataset = None
+        for _line in _output:
+            _line = _line.rstrip("\n")
+            if _line[:1] == "S": ## S name creation-delta guid written
+                _snapshot, _delta, _guid, _written = _line[1:].split("\t")
+                _creation += int(_delta)
+                yield [f"{_dataset}@{_snapshot}","snapshot",_creation,_guid,"0","-",_written,"-","-","-"]
+            elif _line[:2] == "D\t": ## D + alle dataset felder
+                _entry = _line[2:].split("\t")
+                if len(_entry) == self.ZFSLIST_FIELDS:
+                    _dataset = _entry[0]
+                    _creation = int(_entry[2])
+                    yield _entry
+
+    @classmethod
+    def remote_agent(cls,listargs,ignoreattr,compress=False):
+        ## läuft auf dem remote host: snapshot zeilen ohne dataset pfad, konstante spalten und mit creation als differenz
+        _args = [_arg for _arg in listargs.split(",") if _arg]
+        _proc = subprocess.Popen(cls._zfs_list_args(ignoreattr,args=_args),stdout=subprocess.PIPE,encoding="utf-8",errors="replace")
+        _rows = (_entry for _entry in (_line.rstrip("\n").split("\t") for _line in _proc.stdout) if len(_entry) == cls.ZFSLIST_FIELDS)
+        if compress:
+            for _block in cls._wire_encode(_rows):
+                sys.stdout.buffer.write(_block)
+            sys.stdout.buffer.flush()
+            return _proc.wait()
+        _dataset = None
+        _creation = 0
+        for _entry in _rows:
+            _name, _, _snapshot = _entry[0].partition("@")
+            if _entry[1] == "snapshot" and _name == _dataset:
+                sys.stdout.write(f"S{_snapshot}\t{int(_entry[2]) - _creation}\t{_entry[3]}\t{_entry[6]}\n")
+                _creation = int(_entry[2])
+            elif _entry[1] in ("filesystem","volume"):
+                _dataset = _name
+                _creation = int(_entry[2])
+                sys.stdout.write("D\t" + "\t".join(_entry) + "\n")
+        sys.stdout.flush()
+        return _proc.wait()
+
+    ## binäres übertragungsformat für --compress, zlib komprimiert
+    ## D <varint gemeinsamer prefix mit vorherigem dataset> <varint länge> <rest vom namen> <varint länge> <restliche felder mit tab>
+    ## S <varint gemeinsamer prefix mit vorherigem snapshot> <varint länge> <rest vom namen> <zigzag varint creation differenz> <varint guid> <varint written+1, 0 = ->
+    WIRE_BLOCKSIZE = 65536
+
+    @staticmethod
+    def _varint(value,out):
+        while value > 0x7f:
+            out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        out.append(value)
+
+    @staticmethod
+    def _shared_prefix(name,previous):
+        _shared = 0
+        _max = min(len(name),len(previous))
+        while _shared < _max and name[_shared] == previous[_shared]:
+            _shared += 1
+        _rest = name[_shared:]
+        return _shared, _rest
+
+    @classmethod
+    def _wire_encode(cls,rows):
+        _zlib = zlib.compressobj(6)
+        _out = bytearray()
+        _varint = cls._varint
+        _dataset = _snapshot = b""
+        _current = None
+        _creation = 0
+        for _entry in rows:
+            _name, _, _snapname = _entry[0].partition("@")
+            if _entry[1] == "snapshot" and _name == _current:
+                _value = _snapname.encode("utf-8")
+                _shared, _rest = cls._shared_prefix(_value,_snapshot)
+                _delta = int(_entry[2]) - _creation
+                _out.append(0x53) ## S
+                _varint(_shared,_out)
+                _varint(len(_rest),_out)
+                _out += _rest
+                _varint(_delta << 1 if _delta >= 0 else ((-_delta) << 1) - 1,_out)
+                _varint(int(_entry[3]),_out)
+                _varint(int(_entry[6]) + 1 if _entry[6].isdigit() else 0,_out)
+                _snapshot = _value
+                _creation = int(_entry[2])
+            elif _entry[1] in ("filesystem","volume"):
+                _value = _name.encode("utf-8")
+                _shared, _rest = cls._shared_prefix(_value,_dataset)
+                _fields = "\t".join(_entry[1:]).encode("utf-8")
+                _out.append(0x44) ## D
+                _varint(_shared,_out)
+                _varint(len(_rest),_out)
+                _out += _rest
+                _varint(len(_fields),_out)
+                _out += _fields
+                _dataset = _value
+                _current = _name
+                _snapshot = b""
+                _creation = int(_entry[2])
+            if len(_out) > cls.WIRE_BLOCKSIZE:
+                yield _zlib.compress(bytes(_out))
+                _out.clear()
+        yield _zlib.compress(bytes(_out)) + _zlib.flush()
+
+    @classmethod
+    def _wire_decode(cls,blocks):
+        _zlib = zlib.decompressobj()
+        _buffer = b""
+        _dataset = _snapshot = b""
+        _name = ""
+        _creation = 0
+        def _varint(pos):
+            _value = _shift = 0
+            while True:
+                _byte = _buffer[pos]
+                pos += 1
+                _value |= (_byte & 0x7f) << _shift
+                if _byte < 0x80:
+                    return _value, pos
+                _shift += 7
+        for _block in blocks:
+            _buffer = _buffer + _zlib.decompress(_block)
+            _pos = 0
+            while True:
+                _start = _pos
+                try: ## IndexError wenn der datensatz noch nicht komplett ist
+                    _type = _buffer[_pos]
+                    _shared, _pos = _varint(_pos + 1)
+                    _length, _pos = _varint(_pos)
+                    if _pos + _length > len(_buffer):
+                        raise IndexError
+                    _rest = _buffer[_pos:_pos + _length]
+                    _pos += _length
+                    if _type == 0x53: ## S
+                        _delta, _pos = _varint(_pos)
+                        _guid, _pos = _varint(_pos)
+                        _written, _pos = _varint(_pos)
+                        _snapshot = _snapshot[:_shared] + _rest
+                        _creation += (_delta >> 1) if not _delta & 1 else -((_delta + 1) >> 1)
+                        yield [f"{_name}@{_snapshot.decode('utf-8','replace')}","snapshot",_creation,str(_guid),"0","-",str(_written - 1) if _written else "-","-","-","-"]
+                    elif _type == 0x44: ## D
+                        _flength, _pos = _varint(_pos)
+                        if _pos + _flength > len(_buffer):
+                            raise IndexError
+                        _fields = _buffer[_pos:_pos + _flength].decode("utf-8","replace").split("\t")
+                        _pos += _flength
+                        _dataset = _dataset[:_shared] + _rest
+                        _name = _dataset.decode("utf-8","replace")
+                        _snapshot = b""
+                        _creation = int(_fields[1])
+                        yield [_name] + _fields
+                    else:
+                        raise Exception(_("ungültige Daten vom remote agent"))
+                except IndexError:
+                    _pos = _start
+                    break
+            _buffer = _buffer[_pos:]
+        if _buffer or not _zlib.eof:
+            raise Exception(_("unvollständige Daten vom remote agent"))
+
+    def _write_cache(self,filename,data):
+        import json
+        import tempfile
+        try:
+            os.makedirs(os.path.dirname(filename),mode=0o700,exist_ok=True)
+            _fd, _tmpname = tempfile.mkstemp(dir=os.path.dirname(filename),prefix=os.path.basename(filename) + ".") ## daemon, --cached und einzelne läufe schreiben gleichzeitig
+            try:
+                with os.fdopen(_fd,"wt") as _f:
+                    json.dump(data,_f,separators=(",",":"))
+                os.replace(_tmpname,filename)
+            except BaseException:
+                os.unlink(_tmpname)
+                raise
+        except OSError as e:
+            self.print_debug(f"cache {filename} not written: {e}")
+
+    def _history_db(self):
+        import sqlite3
+        _cachedir = self.cachedir or self.DEFAULT_CACHEDIR
+        self._makedirs(_cachedir)
+        _db = sqlite3.connect(os.path.join(_cachedir,"history.sqlite"),timeout=30)
+        ## samples nach series geclustert, abfrage eines datasets liest nur dessen bereich
+        _db.executescript("""
+            CREATE TABLE IF NOT EXISTS series (id INTEGER PRIMARY KEY, source TEXT NOT NULL, replica TEXT NOT NULL, UNIQUE(source,replica));
+            CREATE TABLE IF NOT EXISTS samples (series INTEGER NOT NULL, resolution INTEGER NOT NULL, time INTEGER NOT NULL, n INTEGER NOT NULL,
+                status INTEGER, age INTEGER, age_min INTEGER, age_max INTEGER, count INTEGER, used INTEGER, pending INTEGER,
+                PRIMARY KEY (series,resolution,time)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS samples_time ON samples (resolution,time);
+        """)
+        return _db
+
+    def record_history(self): ## --keep-history, ein datensatz pro source/replika paar und lauf
+        if not self.keep_history:
+            return
+        with self._data_lock:
+            _rows = [_row for _row in self.iter_output() if _row["type"] != "host" and _row["status"] != -1]
+        _now = int(time.time())
+        with self.profiler.phase("history",rows=len(_rows)):
+            _db = self._history_db()
+            try:
+                with _db: ## eine transaktion für alle paare
+                    _db.executemany("INSERT OR IGNORE INTO series (source,replica) VALUES (?,?)",[(_row["source"],_row["replica"]) for _row in _rows])
+                    _series = dict(((_source,_replica),_id) for _id,_source,_replica in _db.execute("SELECT id,source,replica FROM series"))
+                    _db.executemany("INSERT OR REPLACE INTO samples VALUES (?,0,?,1,?,?,?,?,?,?,?)",[
+                        (_series[(_row["source"],_row["replica"])],_now,_row["status"],_row["age"],_row["age"],_row["age"],_row["count"],_row["used"],_row["pending"])
+                        for _row in _rows])
+                    ## volle stunden älter als HISTORY_RAW zusammenfassen, dann alles älter als keep_history tage löschen
+                    _cutoff = (_now - self.HISTORY_RAW) // self.HISTORY_RESOLUTION * self.HISTORY_RESOLUTION
+                    _db.execute("""INSERT OR REPLACE INTO samples SELECT series,?,time / ? * ?,sum(n),max(status),sum(age * n) / sum(n),min(age_min),max(age_max),avg(count),avg(used),avg(pending)
+                        FROM samples WHERE resolution = 0 AND time < ? GROUP BY series,time / ?""",(self.HISTORY_RESOLUTION,) * 3 + (_cutoff,self.HISTORY_RESOLUTION))
+                    _db.execute("DELETE FROM samples WHERE resolution = 0 AND time < ?",(_cutoff,))
+                    _db.execute("DELETE FROM samples WHERE time < ?",(_now - self.keep_history * 86400,))
+            finally:
+                _db.close()
+
+    def history_query(self,window): ## werte der letzten window sekunden pro paar, --filter/--replicafilter auf die namen
+        _since = int(time.time()) - window
+        _output = []
+        _db = self._history_db()
+        try:
+            for _id,_source,_replica in _db.execute("SELECT id,source,replica FROM series ORDER BY source,replica").fetchall():
+                ## --filter wird beim abfragen auf host#dataset angewendet, lokale datasets sind ohne host gespeichert (dataset_name)
+                if not self.filter.search(_source if "#" in _source else f"#{_source}") or (_replica and not self.replicafilter.search(_replica)):
+                    continue
+                _series = _db.execute("""SELECT time,n,status,age,age_min,age_max,count,used,pending FROM samples
+                    WHERE series = ? AND resolution IN (0,?) AND time >= ? ORDER BY time""",(_id,self.HISTORY_RESOLUTION,_since)).fetchall()
+                if not _series:
+                    continue
+                _samples = sum(_row[1] for _row in _series)
+                _output.append({
+                    "status"        : max(_row[2] for _row in _series),
+                    "source"        : _source,
+                    "replica"       : _replica,
+                    "samples"       : _samples,
+                    "first"         : _series[0][0],
+                    "last"          : _series[-1][0],
+                    "age_min"       : min(_row[4] for _row in _series),
+                    "age"           : int(sum(_row[3] * _row[1] for _row in _series) / _samples),
+                    "age_max"       : max(_row[5] for _row in _series),
+                    "count"         : int(round(sum(_row[6] * _row[1] for _row in _series) / _samples)),
+                    "used"          : int(sum(_row[7] * _row[1] for _row in _series) / _samples),
+                    "pending"       : int(sum(_row[8] * _row[1] for _row in _series) / _samples),
+                    "series"        : [[_time,_status,_age,_count,_used,_pending] for _time,_n,_status,_age,_age_min,_age_max,_count,_used,_pending in _series]
+                })
+        finally:
+            _db.close()
+        return _output
+
+    def history_output(self,data):
+        if self.output == "json":
+            return self.json_output(data)
+        _data = [dict((_col,_row[_col]) for _col in self.HISTORY_COLUMNS) for _row in data] ## verlauf nur im json
+        self.columns = self.HISTORY_COLUMNS
+        if self.output == "csv":
+            return self.csv_output(_data)
+        return self.table_output(_data) or ""
+
+    @staticmethod
+    def _only_missing_roots(errors):
+        _lines = [_line for _line in errors.splitlines() if _line.strip()]
+        return bool(_lines) and all(_line.endswith("dataset does not exist") for _line in _lines)
+
+    def _zfs_roots(self,remote): ## filter als dataset wurzeln für zfs list, [] wenn alles gelistet werden muss
+        if self.SHARED_ROWS is not None: ## --batch, filter der anderen configs sind anders
+            return []
+        _roots = []
+        _needed = []
+        if remote in self.source_hosts:
+            _needed.append(self.filter)
+        if self.sourceonly != True: ## replikate können auf jedem host liegen
+            _needed.append(self.replicafilter)
+        for _regex in _needed:
+            _regex_roots = self._pushdown_roots(_regex)
+            if not _regex_roots:
+                return []
+            _roots += _regex_roots
+        _depth = ["-d","1"] if all(_exact for _root,_exact in _roots) else ["-r"] ## nur -d 1 wenn alle exakt, sonst alles rekursiv
+        _roots = sorted(set(_root for _root,_exact in _roots))
+        _roots = [_root for _root in _roots if not any(_root.startswith(_parent + "/") for _parent in _roots)] if _depth == ["-r"] else _roots
+        self.print_debug(f"{remote or 'local'}: zfs list roots {_roots!r}")
+        return _depth + _roots
+
+    @staticmethod
+    def _pushdown_roots(regex):
+        ## nur einfache dataset pfade die mit # (nach dem host) oder ^ am pool verankert sind (auch mit | getrennt) können als zfs list wurzel verwendet werden
+        ## #rpool/data/ -> rpool/data  #rpool/data -> rpool (trifft auch rpool/data2)  #rpool/data$ -> rpool/data ohne kinder
+        ## ohne anker trifft rpool/data per search auch tank/backup/rpool/data, dann muss alles gelistet werden
+        _pattern = getattr(regex,"pattern",None)
+        if not isinstance(regex,re.Pattern) or not _pattern:
+            return None
+        _roots = []
+        for _alternative in _pattern.split("|"):
+            _anchored = _alternative[:1] == "^"
+            _alternative = _alternative[_anchored:]
+            if _alternative[:1] == "#":
+                _anchored = True
+                _alternative = _alternative[1:]
+            if not _anchored:
+                return None
+            _path = []
+            _exact = False
+            _chars = iter(_alternative)
+            for _char in _chars:
+                if _exact: ## $ nur am ende
+                    return None
+                if _char == "\\":
+                    _char = next(_chars,"")
+                    if _char not in "./-" or not _char:
+                        return None
+                    _path.append(_char)
+                elif _char == ".": ## beliebiges zeichen
+                    _path.append(None)
+                elif _char == "$":
+                    _exact = True
+                elif _char.isalnum() or _char in "_:-/":
+                    _path.append(_char)
+                else:
+                    return None
+            if _exact and _path and _path[-1] != "/":
+                _components = _path
+            else:
+                _exact = False
+                _components = _path[:len(_path) - _path[::-1].index("/")] if "/" in _path else [] ## nur ganze komponenten
+            if None in _components or not _components or _components[0] == "/":
+                return None
+            _roots.append(("".join(_components).rstrip("/"),_exact))
+        return _roots
+
+    def _ssh_args(self,remote):
+        _privkeyoption = []
+        if self.ssh_identity:
+            _privkeyoption = ["-i",self.ssh_identity]
+        _sshoptions = ["BatchMode=yes","PreferredAuthentications=publickey"]
+        __sshoptions = []
+        if self.ssh_extra_options:
+            _sshoptions += self.ssh_extra_options.split(",")
+        _parts = remote.split(":")
+        _port = "22"  ## default port
+        if len(_parts) > 1:
+            remote = _parts[0]
+            _port = _parts[1]
+        _controlpath = self._ssh_controlpath(remote,_port)
+        if _controlpath: ## verbindung wiederverwenden (ControlMaster)
+            self._ssh_reused[":".join(_parts)] = self._ssh_check_master(remote,_port,_controlpath)
+            _sshoptions += ["ControlMaster=auto",f"ControlPath={_controlpath}",f"ControlPersist={self.ssh_persist}"]
+        for _sshoption in _sshoptions:
+            __sshoptions += ["-o", _sshoption] ## alle ssh optionen brauchen -o einzeln 
+        return ["ssh",
+            remote, ## Hostname
+            "-T",  ## dont allocate Terminal
+            "-p" ,  _port
+        ] + __sshoptions + _privkeyoption
+
+    def _ssh_controlpath(self,remote,port):
+        import hashlib
+        import tempfile
+        import stat
+        if self.ssh_persist <= 0:
+            return None
+        if self.ssh_extra_options and self.ssh_extra_options.find("Control") > -1: ## eigene ControlMaster optionen haben vorrang
+            return None
+        _controldir = os.path.join(tempfile.gettempdir(),f"checkzfs-{os.getuid()}")
+        try:
+            os.makedirs(_controldir,mode=0o700,exist_ok=True)
+            _stat = os.lstat(_controldir)
+        except OSError:
+            return None
+        if not stat.S_ISDIR(_stat.st_mode) or _stat.st_uid != os.getuid() or stat.S_IMODE(_stat.st_mode) != 0o700: ## von anderem user angelegt oder symlink, fremde master sockets nicht benutzen
+            self.print_debug(f"ssh controlpath {_controldir} not owned by uid {os.getuid()} with mode 0700, no connection reuse")
+            return None
+        ## socket pfad darf nicht zu lang werden, deshalb hash über alles was die verbindung ausmacht
+        _key = hashlib.sha1(f"{remote}:{port}:{self.ssh_identity}:{self.ssh_extra_options}".encode("utf-8")).hexdigest()[:16]
+        return os.path.join(_controldir,f"{_key}.sock")
+
+    def _ssh_check_master(self,remote,port,controlpath): ## True wenn ein laufender master wiederverwendet wird
+        if not os.path.exists(controlpath):
+            return False
+        _start_time = time.time()
+        try:
+            _proc = subprocess.run(["ssh","-O","check","-o",f"ControlPath={controlpath}","-p",port,remote],stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL,timeout=5)
+            _alive = _proc.returncode == 0
+        except subprocess.TimeoutExpired:
+            _alive = False
+        if not _alive: ## socket von abgestürztem/beendetem master
+            self.print_debug(f"{remote}: remove stale ssh control socket {controlpath}")
+            try:
+                os.unlink(controlpath)
+            except OSError:
+                pass
+        self.print_debug(f"{remote}: ssh control socket check {'alive' if _alive else 'dead'} ({time.time() - _start_time:0.3f} sec)")
+        return _alive
+
+    def ssh_cleanup(self): ## laufende master zu allen konfigurierten hosts beenden
+        _persist, self.ssh_persist = self.ssh_persist, 1
+        for _remote in set(self.source_hosts + self.remote_hosts):
+            _remote = _remote.strip()
+            if not _remote:
+                continue
+            _parts = _remote.split(":")
+            _port = _parts[1] if len(_parts) > 1 else "22"
+            _controlpath = self._ssh_controlpath(_parts[0],_port)
+            if _controlpath and os.path.exists(_controlpath):
+                self.print_debug(f"{_remote}: close ssh master {_controlpath}")
+                subprocess.run(["ssh","-O","exit","-o",f"ControlPath={_controlpath}","-p",_port,_parts[0]],stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+        self.ssh_persist = _persist
+
+    def parse_minutes(self,value): ## 90, 12h, 7d, 2w, 1m -> minuten
+        _match = re.fullmatch(r"\s*(\d+)\s*([{0}]?)\s*".format("".join(self.TIME_MULTIPLICATOR)),str(value))
+        if not _match:
+            raise Exception(_("ungültige Zeitangabe {0} (z.B. 90, 12h, 7d)").format(value))
+        return int(_match.group(1)) * self.TIME_MULTIPLICATOR.get(_match.group(2),1)
 
     def convert_ts_date(self,ts,dateformat=None):
         if dateformat:
@@ -596,11 +1951,16 @@ class zfscheck(object):
     def _datasort(self,data):
         if not self.sort:
             return data
+        if self.sort in ("pending","throughput","eta"): ## zahlen, bei sources "" - leere immer ans ende, auch absteigend
+            return sorted(data, key=lambda k: ((k.get(self.sort,"") == "") != self.sortreverse,k.get(self.sort,"")),reverse=self.sortreverse)
         return sorted(data, key=lambda k: k[self.sort],reverse=self.sortreverse)
 
     def checkmk_output(self,data):
-        if not data:
+        if not data and not self.selfcheck and not self.retention:
             return ""
+        return self._checkmk_section(self._checkmk_services(data))
+
+    def _checkmk_services(self,data):
         _out = []
         for _item in self._datasort(data):
             _status     = _item.get("status",3)
@@ -612,6 +1972,9 @@ class zfscheck(object):
             _written    = _item.get("written","0")
             _available  = _item.get("available","0")
             _used       = _item.get("used","0")
+            _pending    = _item.get("pending",0)
+            _throughput = _item.get("throughput","")
+            _eta        = _item.get("eta","")
             if _status == -1: ## tv.sysops:checkzfs=ignore wollen wir nicht (ignoreattr)
                 continue
             if self.maxsnapshots:
@@ -630,12 +1993,156 @@ class zfscheck(object):
                 _threshold  = ";"
             _msg        = _item.get("message","").strip()
             _msg = _msg if len(_msg) > 0 else "OK" ## wenn keine message ... dann OK
-            _out.append(f"{_status} {self.prefix}:{_source} age={_age};{_threshold}|creation={_creation};;|file_size={_written};;|fs_used={_used};;|file_count={_count};{_maxsnapshots} {_replica} - {_msg}")
-        
+            _perfdata = f"age={_age};{_threshold}|creation={_creation};;|file_size={_written};;|fs_used={_used};;|file_count={_count};{_maxsnapshots}"
+            if _replica: ## rückstand nur bei replikaten, durchsatz/eta erst ab dem zweiten lauf mit --cachedir
+                _perfdata += f"|pending_bytes={_pending};;"
+                if _throughput != "":
+                    _perfdata += f"|throughput={_throughput};;"
+                if _eta != "":
+                    _perfdata += f"|eta={_eta};;"
+            _out.append(f"{_status} {self.prefix}:{_source} {_perfdata} {_replica} - {_msg}")
+        if self.retention:
+            _out.extend(self._checkmk_retention())
+        if self.selfcheck:
+            _out.append(self._checkmk_selfcheck())
+        return _out
+
+    def _checkmk_selfcheck(self):
+        ## eigener service mit laufzeit der abfrage, damit check_mk warnt bevor der agent timeout erreicht ist
+        _warn, _crit = self.selfcheck
+        _runtime = self._stats.get("runtime",0)
+        _status = 2 if _runtime >= _crit else 1 if _runtime >= _warn else 0
+        _perfdata = [f"runtime={_runtime:.3f};{_warn:g};{_crit:g}".replace("inf","")] + [f"{_key}={self._stats.get(_key,0)};;" for _key in ("rows","datasets","snapshots")]
+        for _remote,_stats in self._host_stats.items():
+            _name = re.sub(r"\W","_",_remote or "local")
+            _perfdata += [f"fetch_{_name}={_stats['seconds']:.3f};;",f"bytes_{_name}={_stats['bytes']};;",f"rows_{_name}={_stats['rows']};;"]
+        _msg = _("Laufzeit {0:.1f} sec, {1} Hosts ({2} fehlerhaft), {3} Datasets, {4} Snapshots").format(_runtime,self._stats.get("hosts",0),self._stats.get("failed",0),self._stats.get("datasets",0),self._stats.get("snapshots",0))
+        if _status:
+            _msg += _(" - Laufzeit über {0:g} sec").format(self.selfcheck[_status - 1])
+        return f"{_status} {self.prefix}:checkzfs_self {'|'.join(_perfdata)} {_msg}"
+
+    def _checkmk_section(self,services,cached=None):
+        if cached: ## local check cache prefix cached(zeitpunkt,intervall)
+            services = [f"cached({cached[0]:.0f},{cached[1]}) {_line}" for _line in services]
+        else:
+            services = list(services)
         if self.piggyback != "":
-            _out.insert(0,f"<<<<{self.piggyback}>>>>\n<<<local:sep(0)>>>")
-            _out.append("<<<<>>>>")
-        return "\n".join(_out)
+            services.insert(0,f"<<<<{self.piggyback}>>>>\n<<<local:sep(0)>>>")
+            services.append("<<<<>>>>")
+        return "\n".join(services)
+
+    def checkmk_cached_output(self):
+        ## ergebnis aus datei liefern und bei bedarf im hintergrund neu erzeugen
+        import json
+        import fcntl
+        _cachedir = self.cachedir or self.DEFAULT_CACHEDIR
+        _resultfile = os.path.join(_cachedir,f"checkmk-{self._config_key}.json")
+        _lockfile = open(f"{_resultfile}.lock","a") if os.path.isdir(_cachedir) or self._makedirs(_cachedir) else None
+        if self.cached_refresh: ## detached prozess
+            try:
+                fcntl.flock(_lockfile,fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (OSError,TypeError): ## läuft schon
+                return None
+            self._checkmk_refresh(_resultfile)
+            return None
+        try:
+            with open(_resultfile,"rt") as _f:
+                _result = json.load(_f)
+        except (OSError,ValueError):
+            _result = None
+        if _result and time.time() - _result.get("time",0) < self.cached:
+            return self._checkmk_section(_result.get("services",[]),cached=(_result.get("time"),self.cached))
+        if _result and _lockfile:
+            try: ## nur starten wenn nicht schon ein refresh läuft
+                fcntl.flock(_lockfile,fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(_lockfile,fcntl.LOCK_UN)
+                self.print_debug(f"start background refresh for {_resultfile}")
+                subprocess.Popen([sys.executable,os.path.abspath(sys.argv[0])] + sys.argv[1:] + ["--cached-refresh"],
+                    stdin=subprocess.DEVNULL,stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL,start_new_session=True,close_fds=True)
+            except OSError:
+                pass
+            return self._checkmk_section(_result.get("services",[]),cached=(_result.get("time"),self.cached)) ## altes ergebnis, check_mk sieht das alter
+        if _lockfile: ## noch kein ergebnis, einmal direkt abfragen
+            fcntl.flock(_lockfile,fcntl.LOCK_EX)
+        _result = self._checkmk_refresh(_resultfile)
+        return self._checkmk_section(_result.get("services",[]),cached=(_result.get("time"),self.cached))
+
+    def _checkmk_refresh(self,resultfile):
+        _result = {"time": time.time()}
+        self.get_data()
+        self.record_history()
+        _result["services"] = self._checkmk_services(self.get_output())
+        self._write_cache(resultfile,_result)
+        return _result
+
+    def serve_daemon(self):
+        ## daten im speicher halten, regelmäßig neu holen und über unix socket in allen formaten ausliefern
+        import json
+        import socketserver
+        import signal
+        signal.signal(signal.SIGTERM,lambda *args: sys.exit(0)) ## damit der socket aufgeräumt wird
+        _zfscheck = self
+        class _request_handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    _request = json.loads(self.rfile.readline() or "{}")
+                    _output = _request.get("output","checkmk")
+                    if _output not in _zfscheck.RENDER_OUTPUTS:
+                        raise Exception(_("ungültiges Ausgabeformat {0}").format(_output))
+                    _response = "OK\n{0}".format(_zfscheck.render(_output))
+                except Exception as e:
+                    _response = f"ERROR {e}"
+                self.wfile.write(_response.encode("utf-8"))
+
+        if os.path.exists(self.daemon): ## alter socket, evtl. läuft schon ein daemon
+            try:
+                self.daemon_request(self.daemon,"checkmk",timeout=5)
+                raise Exception(_("daemon läuft bereits auf {0}").format(self.daemon))
+            except OSError:
+                os.unlink(self.daemon)
+        _refresh_time = time.time()
+        self.get_data()
+        self.record_history()
+        _server = socketserver.ThreadingUnixStreamServer(self.daemon,_request_handler)
+        _server.daemon_threads = True
+        os.chmod(self.daemon,0o600)
+        threading.Thread(target=_server.serve_forever,daemon=True).start()
+        self.print_debug(f"daemon listening on {self.daemon} / refresh every {self.interval} sec")
+        try:
+            while True:
+                time.sleep(max(1,self.interval - (time.time() - _refresh_time)))
+                _refresh_time = time.time()
+                try:
+                    self.get_data()
+                    self.record_history()
+                except Exception as e: ## alte daten behalten
+                    print(f"refresh failed: {e}",file=sys.stderr)
+        finally:
+            _server.shutdown()
+            _server.server_close()
+            os.unlink(self.daemon)
+
+    @staticmethod
+    def daemon_request(path,output,timeout=60): ## client zum daemon
+        import json
+        import socket
+        with socket.socket(socket.AF_UNIX,socket.SOCK_STREAM) as _socket:
+            _socket.settimeout(timeout)
+            _socket.connect(path)
+            _socket.sendall(json.dumps({"output":output}).encode("utf-8") + b"\n")
+            _socket.shutdown(socket.SHUT_WR)
+            _response = b"".join(iter(lambda: _socket.recv(65536),b"")).decode("utf-8")
+        _status, _, _body = _response.partition("\n")
+        if _status != "OK":
+            raise Exception(_status[6:] if _status.startswith("ERROR ") else _("ungültige Antwort vom daemon"))
+        return _body
+
+    def _makedirs(self,path):
+        try:
+            os.makedirs(path,mode=0o700,exist_ok=True)
+            return True
+        except OSError:
+            return False
 
     def table_output(self,data,color=True):
         if not data:
@@ -670,6 +2177,7 @@ class zfscheck(object):
         return "\n".join(_out)
 
     def html_output(self,data,columns=None):
+        import socket
         if not data:
             return ""
         _header = data[0].keys() if not self.columns else self.columns
@@ -703,6 +2211,9 @@ class zfscheck(object):
         return "".join(_out)
 
     def mail_output(self,data):
+        import socket
+        from email.message import EmailMessage
+        from email.utils import formatdate
         _hostname = socket.getfqdn()
         _email = self.mail_address
         if not _email:
@@ -739,14 +2250,162 @@ class zfscheck(object):
         return "\n".join(_output)
 
     def json_output(self,data):
+        import json
         return json.dumps(data)
 
+    ZABBIX_DISCOVERY_KEY = "checkzfs.discovery"
+    ZABBIX_ITEMS = ("status","age","count","used","available","written","creation","pending","throughput","eta","snapshot","message") ## item checkzfs.<key>["<name>"]
+    ZABBIX_TEXT_ITEMS = ("snapshot","message") ## alle anderen sind numerisch, leere werte (throughput/eta vor dem zweiten lauf) nicht senden
+    def zabbix_output(self,data): ## low level discovery json, mit zabbix_sender alle werte des laufs in einer datei
+        import json
+        import tempfile
+        _discovery = []
+        _values = []
+        for _item in self._datasort(data):
+            if _item.get("status",3) == -1: ## ignore wie bei checkmk
+                continue
+            _name = _item.get("replica","") or _item.get("source","") ## replika datasets sind pro host eindeutig
+            _discovery.append({"{#NAME}":_name,"{#SOURCE}":_item.get("source",""),"{#REPLICA}":_item.get("replica",""),"{#TYPE}":"replica" if _item.get("replica") else _item.get("type","")})
+            for _key in self.ZABBIX_ITEMS:
+                _value = _item.get(_key,"")
+                if _value == "" and _key not in self.ZABBIX_TEXT_ITEMS:
+                    continue
+                _values.append((f"checkzfs.{_key}[{self._zabbix_param(_name)}]",_value))
+        _lld = json.dumps({"data":_discovery})
+        if not self.zabbix_sender:
+            return _lld
+        _lines = self.zabbix_sender_lines([(self.ZABBIX_DISCOVERY_KEY,_lld)] + _values) ## discovery als trapper item, alles in einem zabbix_sender aufruf
+        if self.zabbix_sender == "-":
+            return _lines.rstrip("\n")
+        _dir = os.path.dirname(os.path.abspath(self.zabbix_sender))
+        os.makedirs(_dir,exist_ok=True)
+        _fd, _tmpname = tempfile.mkstemp(dir=_dir,prefix=os.path.basename(self.zabbix_sender) + ".") ## zabbix_sender soll nie eine halbe datei lesen, gleichzeitige läufe eigene datei
+        try:
+            with os.fdopen(_fd,"wt") as _f:
+                _f.write(_lines)
+            os.chmod(_tmpname,0o644) ## mkstemp legt 0600 an, zabbix_sender läuft evtl. als anderer user
+            os.replace(_tmpname,self.zabbix_sender)
+        except BaseException:
+            os.unlink(_tmpname)
+            raise
+        return _lld
+
+    @staticmethod
+    def _zabbix_param(value): ## item key parameter immer quoten, dataset namen können , ] und leerzeichen enthalten
+        return '"{0}"'.format(str(value).replace('"','\\"'))
+
+    @staticmethod
+    def _zabbix_sender_field(value): ## zabbix_sender -i: leerzeichen getrennt, mit " quoten wenn nötig, \\ und \" escapen
+        value = str(value)
+        if value and not re.search(r'[\s"\\]',value):
+            return value
+        return '"{0}"'.format(value.replace("\\","\\\\").replace('"','\\"'))
+
+    def zabbix_sender_lines(self,values): ## eine zeile <host> <key> <zeit> <wert> pro item, alle mit dem gleichen zeitstempel
+        _host = self._zabbix_sender_field(self.piggyback or "-") ## - ist der hostname aus der zabbix_sender/agent config
+        _clock = int(time.time())
+        return "".join(f"{_host} {self._zabbix_sender_field(_key)} {_clock} {self._zabbix_sender_field(_value)}\n" for _key,_value in values)
+
+    def stream_output(self,fmt,out): ## --stream, zeilen ausgeben während die datasets ausgewertet werden
+        with self._data_lock:
+            self._overall_status = []
+            if self._columns_default:
+                self.columns = self._default_columns(self.output)
+            with self.profiler.phase("render",output=f"stream:{fmt}") as _phase:
+                if self.output == "snaplist":
+                    _rows = self.iter_snaplist()
+                elif self.output == "gaps":
+                    _rows = self.iter_gaps()
+                elif self.output == "topology":
+                    _rows = self.iter_topology()
+                elif self.output == "retention":
+                    _rows = self.iter_retention()
+                else:
+                    _rows = self._datasort(self.iter_output(chunksize=self.STREAM_CHUNK)) ## mit --sort müssen alle zeilen erst gesammelt werden
+                if fmt == "ndjson":
+                    _count = self._stream_ndjson(_rows,out)
+                elif fmt == "csv":
+                    _count = self._stream_csv(_rows,out)
+                else:
+                    _count = self._stream_table(_rows,out)
+                _phase["args"]["rows"] = _count
+                out.flush()
+
+    def _stream_ndjson(self,rows,out):
+        import json
+        _count = 0
+        for _count,_item in enumerate(rows,1):
+            out.write(json.dumps(_item) + "\n")
+        return _count
+
+    def _stream_csv(self,rows,out,separator=";"): ## wie csv_output
+        _count = 0
+        for _count,_item in enumerate(rows,1):
+            if _count == 1:
+                _header = list(_item.keys()) ## alles
+                _converter = dict((i,self.COLUMN_MAPPER.get(i,(lambda x: str(x)))) for i in _header)
+                out.write(separator.join([self.COLUMN_NAMES.get(i,i) for i in _header]) + "\n")
+            out.write(separator.join([_converter.get(_col)(_item.get(_col,"")) for _col in _header]) + "\n")
+        return _count
+
+    def _stream_table(self,rows,out,color=True): ## wie table_output, breite aus den ersten stream_sample zeilen oder fest, längere werte verschieben die zeile
+        rows = iter(rows) ## mit --sort eine liste
+        _sample = list(itertools.islice(rows,self.stream_sample)) if self.stream_sample > 0 else list(itertools.islice(rows,1))
+        if not _sample:
+            return 0
+        _header = list(_sample[0].keys()) if not self.columns else self.columns
+        _header_names = [self.COLUMN_NAMES.get(i,i) for i in _header]
+        _converter = dict((i,self.COLUMN_MAPPER.get(i,(lambda x: str(x)))) for i in _header)
+        _line_draw = (" ║ ","═╬═","═") if color else (" | ","-+-","-")
+        _sample = [(_item.get("status"),[_converter.get(_col)(_item.get(_col,"")) for _col in _header]) for _item in _sample]
+        if self.stream_sample > 0:
+            _maxwidth = [max(map(len,_col)) for _col in zip(_header_names,*[_cells for _status,_cells in _sample])]
+        else:
+            _maxwidth = [max(len(_name),self.STREAM_WIDTHS.get(_col,10)) for _col,_name in zip(_header,_header_names)]
+        _format = _line_draw[0].join(["{{:{}{}}}".format(self.COLUMN_ALIGN.get(_h,">"),_w) for _h,_w in zip(_header,_maxwidth)])
+        _reset = self.COLOR_CONSOLE.get("reset") if color else ""
+        out.write(_format.format(*_header_names) + _reset + "\n")
+        out.write(_line_draw[1].join(map(lambda x: x*_line_draw[2],_maxwidth)) + "\n") ## trennlinie
+        _rows = itertools.chain(_sample,((_item.get("status"),[_converter.get(_col)(_item.get(_col,"")) for _col in _header]) for _item in rows))
+        _count = 0
+        for _count,(_status,_cells) in enumerate(_rows,1):
+            out.write((self.COLOR_CONSOLE.get(_status,"") if color else "") + _format.format(*_cells) + _reset + "\n")
+        return _count
+
     def print_debug(self,msg,*args,**kwargs):
         if self.debug:
             sys.stderr.write(f"DEBUG: {msg}\n")
             sys.stderr.flush()
 
 if __name__ == "__main__":
+    ## deaktivierte config so früh wie möglich beenden, vor argparse und config parser (plugin läuft evtl. dutzende male pro minute)
+    _basename = os.path.basename(__file__).split(".")[0]  ## name für config ermitteln aufgrund des script namens
+    _early_config = None
+    for _i,_arg in enumerate(sys.argv[1:],1):
+        if _arg == "--config" and _i + 1 < len(sys.argv):
+            _early_config = sys.argv[_i + 1]
+        elif _arg.startswith("--config="):
+            _early_config = _arg[9:]
+    _family = re.sub(r"\d+$","",_basename) ## checkzfs2, checkzfs3 ... gehören zu checkzfs
+    if os.environ.get("MK_CONFDIR"):
+        _early_config = os.path.join("/etc/check_mk" if os.path.isdir("/etc/check_mk") else os.environ["MK_CONFDIR"],_basename)
+        if _family != _basename: ## wenn die config von checkzfs batch: 1 hat, läuft diese config dort mit
+            try:
+                with open(os.path.join(os.path.dirname(_early_config),_family),"rt") as _f:
+                    if re.search(r"^batch:[ \t]*(1|yes|true)(?:\s|$)",_f.read(),re.M | re.I):
+                        os._exit(0)
+            except OSError:
+                pass
+    if os.path.dirname(os.path.abspath(__file__)).find("/zabbix/scripts") > -1:
+        _early_config = f"/etc/zabbix/checkzfs-{_basename}"
+    try:
+        with open(_early_config,"rt") as _f:
+            _early_content = _f.read()
+        if re.search(r"^disabled:[ \t]*(1|yes|true)(?:\s|$)",_early_content,re.M | re.I) and not re.search(r"^batch:[ \t]*(1|yes|true)(?:\s|$)",_early_content,re.M | re.I): ## mit batch laufen die anderen configs trotzdem
+            os._exit(0)
+    except (OSError,TypeError):
+        pass
+
     import argparse
     _parser = argparse.ArgumentParser(f"Tool to check ZFS Replication age\nVersion: {VERSION}\n##########################################\n")
     _parser.add_argument('--remote',type=str,
@@ -759,8 +2418,12 @@ if __name__ == "__main__":
                 help=_("Regex Filter Snapshot snapshots die überhaupt benutzt werden (z.B. daily)"))
     _parser.add_argument("--replicafilter",type=str,
                 help=_("Regex Filter wo nach replikaten gesucht werden soll (z.B. remote)"))
-    _parser.add_argument("--output",type=str,default="",choices=["html","text","mail","checkmk","json","csv","snaplist"],
+    _parser.add_argument("--output",type=str,default="",choices=["html","text","mail","checkmk","json","csv","snaplist","gaps","topology","retention","zabbix"],
                 help=_("Ausgabeformat"))
+    _parser.add_argument("--stream",type=str,choices=["table","csv","ndjson"],
+                help=_("Zeilen schon während der Auswertung ausgeben statt die ganze Ausgabe im Speicher aufzubauen (text/csv/json/snaplist/gaps/topology/retention)"))
+    _parser.add_argument("--stream-sample",type=str,metavar="rows",
+                help=_("--stream table: Spaltenbreite aus den ersten x Zeilen (Standard 1000, 0 = feste Breiten)"))
     _parser.add_argument("--columns",type=str,
                 help=_("Zeige nur folgende Spalten ({0})".format(",".join(zfscheck.VALIDCOLUMNS))))
     _parser.add_argument("--sort",type=str,choices=zfscheck.VALIDCOLUMNS,
@@ -782,24 +2445,63 @@ if __name__ == "__main__":
     _parser.add_argument("--snaplist","-s",action="store_const",dest="output",const="snaplist",
                 help=_("kurz für --output snaplist"))
     _parser.add_argument("--legacyhosts",type=str,
-                help=_("Hosts der Source und Remote die kein zfs list mit allen Parametern können rufen zfs_legacy_list auf"))
+                help=_("Hosts der Source und Remote die kein zfs list mit allen Parametern können, werden mit zfs get abgefragt"))
+    _parser.add_argument("--agenthosts",type=str,
+                help=_("Hosts auf denen checkzfs selbst (über ssh mit python3) die Liste erstellt und kompakt zurückliefert"))
+    _parser.add_argument("--remote-agent",nargs="?",const="",type=str,metavar="zfs list args",
+                help=_("auf dem Remote Host ausführen: zfs list kompakt ausgeben (wird von --agenthosts benutzt)"))
+    _parser.add_argument("--compress",nargs="?",const="1",type=str,
+                help=_("binäres komprimiertes Übertragungsformat für --agenthosts"))
     _parser.add_argument("--prefix",type=str,default='REPLICA',
                help=_("Prefix für check_mk Service (keine Leerzeichen)"))
+    _parser.add_argument("--timeout",type=str,
+                help=_("Timeout in Sekunden pro Host (Standard 60)"))
     _parser.add_argument("--ssh-identity",type=str,
                 help=_("Pfad zum ssh private key"))
     _parser.add_argument("--piggyback",type=str,default="",
                 help=_("Zuordnung zu anderem Host bei checkmk"))
     _parser.add_argument("--ssh-extra-options",type=str,
                 help=_("zusätzliche SSH Optionen mit Komma getrennt (HostKeyAlgorithms=ssh-rsa)"))
+    _parser.add_argument("--ssh-persist",type=str,
+                help=_("SSH Verbindung für x Sekunden offen halten und wiederverwenden (Standard 300, 0 = aus)"))
+    _parser.add_argument("--cachedir",nargs="?",const=zfscheck.DEFAULT_CACHEDIR,type=str,
+                help=_("Inventar zwischen den Läufen speichern und nur geänderte Datasets (snapshots_changed) neu abfragen"))
+    _parser.add_argument("--cached",type=str,metavar="seconds",
+                help=_("checkmk Ergebnis aus dem Cache liefern und nach x Sekunden im Hintergrund erneuern"))
+    _parser.add_argument("--cached-refresh",action="store_true",
+                help=argparse.SUPPRESS)
+    _parser.add_argument("--daemon",type=str,metavar="socket",
+                help=_("als Daemon laufen, Daten im Speicher halten und über den Unix Socket ausliefern"))
+    _parser.add_argument("--interval",type=str,metavar="seconds",
+                help=_("Abfrageintervall im Daemon Modus (Standard 60)"))
+    _parser.add_argument("--client",type=str,metavar="socket",
+                help=_("Ausgabe vom laufenden Daemon holen"))
     _parser.add_argument("--update",nargs="?",const="main",type=str,metavar="branch/commitid",
         help=_("check for update"))
+    _parser.add_argument("--batch",action="store_true",
+                help=_("alle configs der Plugin Familie (checkzfs, checkzfs2, ...) in einem Lauf, jeder Host wird nur einmal abgefragt"))
+    _parser.add_argument("--selfcheck",nargs="?",const="",type=str,metavar="warn,crit",
+                help=_("zusätzlicher checkmk Service checkzfs_self mit Laufzeit pro Host, warn/crit Laufzeit in Sekunden (Standard 30,50)"))
+    _parser.add_argument("--profile",nargs="?",const="-",type=str,metavar="file",
+                help=_("Laufzeit, CPU, gelesene Bytes und Zeilen pro Phase als Chrome Trace json ausgeben (ohne Datei nach stderr)"))
+    _parser.add_argument("--profile-hook",type=str,metavar="cprofile|tracemalloc:phase[:host]",
+                help=_("eine Phase (fetch,index,link,evaluate,render) zusätzlich mit cProfile oder tracemalloc messen"))
+    _parser.add_argument("--retention",type=str,metavar="label=anzahl:alter,...",
+                help=_("erwartete Anzahl und max. Alter des neuesten Snapshots pro Label (z.B. hourly=24:2h,daily=7:26h), als checkmk Services"))
+    _parser.add_argument("--keep-history",nargs="?",const="",type=str,metavar="days",
+                help=_("Alter, Anzahl, genutzt und ausstehend pro Lauf im cachedir (history.sqlite) speichern, x Tage behalten (Standard 30)"))
+    _parser.add_argument("--history",nargs="?",const="1d",type=str,metavar="window",
+                help=_("gespeicherten Verlauf der letzten Zeit (90, 12h, 7d) abfragen, min/max/durchschnitt pro Paar, mit --output json auch die Werte"))
+    _parser.add_argument("--zabbix-sender",type=str,metavar="file",
+                help=_("mit --output zabbix alle Werte des Laufs als zabbix_sender Datei schreiben (zabbix_sender -T -i file), - statt der Discovery auf stdout"))
     _parser.add_argument("--debug",action="store_true",
                 help=_("debug Ausgabe"))
     args = _parser.parse_args()
+    if args.remote_agent is not None: ## gegenstelle von --agenthosts, keine config
+        sys.exit(zfscheck.remote_agent(args.remote_agent,args.ignoreattr,compress=args.compress))
 
-    CONFIG_KEYS="disabled|source|sourceonly|piggyback|remote|legacyhosts|prefix|filter|replicafilter|threshold|ignoreattr|maxsnapshots|snapshotfilter|ssh-identity|ssh-extra-options"
+    CONFIG_KEYS="disabled|source|sourceonly|piggyback|remote|legacyhosts|prefix|filter|replicafilter|threshold|ignoreattr|maxsnapshots|snapshotfilter|ssh-identity|ssh-extra-options|ssh-persist|timeout|cachedir|cached|client|agenthosts|compress|selfcheck|batch|keep-history|retention|zabbix-sender"
     _config_regex = re.compile(rf"^({CONFIG_KEYS}):\s*(.*?)(?:\s+#|$)",re.M)
-    _basename = os.path.basename(__file__).split(".")[0]  ## name für config ermitteln aufgrund des script namens
     #_is_checkmk_plugin = os.path.dirname(os.path.abspath(__file__)).find("/check_mk_agent/local") > -1 ## wenn im check_mk ordner
     #if _is_checkmk_plugin:
     if os.environ.get("MK_CONFDIR"):
@@ -835,19 +2537,35 @@ if __name__ == "__main__":
                 os._exit(0)
         except:
             pass
-        args.output = "json" if not args.output else args.output
 
-    if args.config_file:
-        _rawconfig = open(args.config_file,"rt").read()
+    def _apply_config(args,config_file): ## werte aus der config übernehmen wenn nicht als argument gesetzt, False wenn disabled
+        _rawconfig = open(config_file,"rt").read()
+        _enabled = True
         for _k,_v in _config_regex.findall(_rawconfig):
             if _k == "disabled" and _v.lower().strip() in ( "1","yes","true"): ## wenn disabled dann ignorieren check wird nicht durchgeführt
-                os._exit(0)
-            if _k == "sourceonly":
-                args.sourceonly = bool(_v.lower().strip() in ( "1","yes","true"))
+                _enabled = False ## batch trotzdem noch lesen
+            elif _k in ("sourceonly","batch"):
+                args.__dict__[_k] = bool(_v.lower().strip() in ( "1","yes","true"))
             elif _k == "prefix":
                 args.__dict__["prefix"] = _v.strip()
             elif not args.__dict__.get(_k.replace("-","_"),None):
                 args.__dict__[_k.replace("-","_")] = _v.strip()
+        return _enabled
+
+    _batch_configs = []
+    _enabled = True
+    if args.config_file:
+        _cli_args = argparse.Namespace(**vars(args)) ## für die anderen configs im batch nur die argumente
+        _enabled = _apply_config(args,args.config_file)
+        if not _enabled and not args.batch:
+            os._exit(0)
+        if args.batch: ## alle configs der plugin familie (checkzfs, checkzfs2 ...) im gleichen verzeichnis
+            _configdir = os.path.dirname(os.path.abspath(args.config_file))
+            _configname = re.sub(r"\d+$","",os.path.basename(args.config_file))
+            _batch_configs = sorted((_name for _name in os.listdir(_configdir) if re.fullmatch(rf"{re.escape(_configname)}\d+",_name)),key=lambda x: int(x[len(_configname):]))
+            _batch_configs = [os.path.join(_configdir,_name) for _name in _batch_configs]
+    if _is_zabbix_plugin and not args.output: ## erst nach der config, mit zabbix-sender low level discovery statt json
+        args.output = "zabbix" if args.zabbix_sender else "json"
 
     try:
         if args.update:
@@ -907,6 +2625,22 @@ if __name__ == "__main__":
                         print(_line)
                 else:
                     break
+        elif args.client:
+            print(zfscheck.daemon_request(args.client,args.output or "text"))
+        elif args.batch:
+            zfscheck.SHARED_ROWS = {} ## jeder host wird für alle configs nur einmal abgefragt
+            _exitcode = 0
+            for _config_file,_args in ([(args.config_file,args)] if _enabled else []) + [(_file,argparse.Namespace(**vars(_cli_args))) for _file in _batch_configs]:
+                if _args is not args and not _apply_config(_args,_config_file):
+                    continue
+                _args.config_file = _config_file
+                _args.cached = None ## ein refresh im hintergrund würde den ganzen batch neu starten
+                try:
+                    zfscheck(**_args.__dict__)
+                except Exception as e: ## andere configs trotzdem ausgeben
+                    print(f"{_config_file}: {e}", file=sys.stderr)
+                    _exitcode = 1
+            sys.exit(_exitcode)
         else:
             ZFSCHECK_OBJ = zfscheck(**args.__dict__)
     except KeyboardInterrupt: